@@ -2,21 +2,200 @@
 '''
     Password Encryption and Validation Module
 '''
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
 import bcrypt
 
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+# Security floor: calibration never goes below it (BCRYPT_MIN_ROUNDS).
+ROUNDS_FLOOR = min(MAX_ROUNDS, max(
+    MIN_ROUNDS, int(os.getenv("BCRYPT_MIN_ROUNDS", DEFAULT_ROUNDS))))
+# Work factor used by hash_password; calibrate_rounds() adjusts it.
+rounds = DEFAULT_ROUNDS
+
 
 def hash_password(password: str) -> bytes:
     '''
     Generates a salted and hashed password.
     '''
     encoded = password.encode()
-    hashed = bcrypt.hashpw(encoded, bcrypt.gensalt())
+    hashed = bcrypt.hashpw(encoded, bcrypt.gensalt(rounds))
     return hashed
 
 
+def _p95(samples: List[float]) -> float:
+    '''
+    Returns the 95th percentile of a list of timings.
+    '''
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+def calibrate_rounds(budget_ms: float = 250.0, samples: int = 5,
+                     min_rounds: int = ROUNDS_FLOOR,
+                     max_rounds: int = 16) -> int:
+    '''
+    Picks the highest bcrypt cost whose p95 hashing time on this machine
+    fits in `budget_ms`, and makes hash_password use it.
+
+    Each extra round doubles the work, so costs are timed from
+    `min_rounds` upwards until one exceeds the budget. `min_rounds` is
+    used even if it does not fit, and is never below ROUNDS_FLOOR, so a
+    slow or busy machine cannot weaken new hashes.
+    '''
+    global rounds
+    min_rounds = max(ROUNDS_FLOOR, min_rounds)
+    max_rounds = max(min_rounds, min(MAX_ROUNDS, max_rounds))
+    chosen = min_rounds
+    for cost in range(min_rounds, max_rounds + 1):
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.hashpw(b'calibration', bcrypt.gensalt(cost))
+            timings.append((time.perf_counter() - start) * 1000)
+        if _p95(timings) > budget_ms:
+            break
+        chosen = cost
+    rounds = chosen
+    return chosen
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    '''
+    Reads the cost stored in a bcrypt hash ($2b$<cost>$...).
+    '''
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    '''
+    Tells whether a hash was made with a cost lower than the current one.
+    Stronger hashes are kept, so hosts calibrated differently don't make
+    a hash flip between costs.
+    '''
+    return hash_rounds(hashed_password) < rounds
+
+
 def is_valid(hashed_password: bytes, password: str) -> bool:
     '''
     Checks whether the provided password matches the hashed password.
     '''
     encoded = password.encode()
     return bcrypt.checkpw(encoded, hashed_password)
+
+
+def verify_and_rehash(hashed_password: bytes,
+                      password: str) -> Tuple[bool, Optional[bytes]]:
+    '''
+    Checks a password like is_valid and, when it matches a hash with an
+    outdated cost, also returns a new hash for the caller to store.
+
+    Return:
+        (valid, new_hash) where new_hash is None unless an upgrade is due.
+    '''
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, hash_password(password)
+    return True, None
+
+
+def _is_valid_pair(pair: Tuple[bytes, str]) -> bool:
+    '''
+    Unpacks a (hashed_password, password) pair for is_valid.
+    '''
+    return is_valid(*pair)
+
+
+class HashingService:
+    '''
+    Runs hash_password and is_valid on a pool sized to the machine.
+
+    bcrypt releases the GIL while hashing, so the default thread pool
+    scales across cores; use_processes=True switches to a process pool.
+    '''
+
+    def __init__(self, max_workers: int = None,
+                 use_processes: bool = False):
+        '''
+        Creates the pool, with os.cpu_count() workers by default.
+        '''
+        self.max_workers = max_workers or os.cpu_count() or 1
+        pool_class = ProcessPoolExecutor if use_processes \
+            else ThreadPoolExecutor
+        self.executor: Executor = pool_class(max_workers=self.max_workers)
+
+    def hash_many(self, passwords: Iterable[str]) -> List[bytes]:
+        '''
+        Hashes several passwords in parallel, preserving order.
+        '''
+        return list(self.executor.map(hash_password, passwords))
+
+    def verify_many(self, pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+        '''
+        Checks several (hashed_password, password) pairs in parallel.
+        '''
+        return list(self.executor.map(_is_valid_pair, pairs))
+
+    async def hash_password(self, password: str) -> bytes:
+        '''
+        Coroutine hashing a password without blocking the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, hash_password,
+                                          password)
+
+    async def is_valid(self, hashed_password: bytes, password: str) -> bool:
+        '''
+        Coroutine checking a password without blocking the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, is_valid,
+                                          hashed_password, password)
+
+    def shutdown(self, wait: bool = True):
+        '''
+        Stops the worker pool.
+        '''
+        self.executor.shutdown(wait=wait)
+
+
+_SERVICE = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_hashing_service() -> HashingService:
+    '''
+    Retrieves the shared HashingService, created on first use.
+    '''
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _SERVICE = HashingService()
+        return _SERVICE
+
+
+def hash_many(passwords: Iterable[str]) -> List[bytes]:
+    '''
+    Hashes several passwords on the shared pool.
+    '''
+    return get_hashing_service().hash_many(passwords)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+    '''
+    Checks several (hashed_password, password) pairs on the shared pool.
+    '''
+    return get_hashing_service().verify_many(pairs)
+
+
+if os.getenv("BCRYPT_LATENCY_BUDGET_MS"):
+    calibrate_rounds(float(os.getenv("BCRYPT_LATENCY_BUDGET_MS")))
@@ -2,10 +2,25 @@
 '''
     Script for managing personal data securely.
 '''
+import argparse
+import atexit
 import logging
+import logging.handlers
+import mmap
+import os
+import queue
 import re
+import sys
+import threading
+import time
+import weakref
 import mysql.connector
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, IO, Iterator, List, Pattern, Sequence, \
+    Tuple
 from os import environ
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
@@ -32,6 +47,45 @@ def filter_datum(fields: List[str], redaction: str,
     return message
 
 
+@lru_cache(maxsize=64)
+def compile_redaction(fields: Tuple[str, ...], separator: str) -> Pattern:
+    '''
+        Builds (and caches) a single alternation pattern matching every
+        field in one scan of the log line.
+
+        Arguments:
+        fields: A tuple of field names to obfuscate.
+        separator: The character separating fields in the log line.
+
+        Return:
+            Compiled pattern capturing the field name in group 1.
+    '''
+    alternation = '|'.join(f'(?:{field})' for field in fields)
+    return re.compile(f'({alternation})=.*?{separator}')
+
+
+def redact(fields: List[str], redaction: str,
+           message: str, separator: str) -> str:
+    '''
+        Single-pass equivalent of filter_datum.
+
+        Arguments:
+        fields: A list of strings representing all fields to obfuscate.
+        redaction: A string representing by what the field will be obfuscated.
+        message: A string representing the log line.
+        separator: A string representing by which character is separating
+        all fields in the log line (message).
+
+        Return:
+            String with redacted values.
+    '''
+    if not fields:
+        return message
+    pattern = compile_redaction(tuple(fields), separator)
+    tail = f'={redaction}{separator}'
+    return pattern.sub(lambda match: match.group(1) + tail, message)
+
+
 class RedactingFormatter(logging.Formatter):
     """ Redacting Formatter class. """
 
@@ -39,6 +93,11 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
+    # record -> {(fields, redaction, separator): redacted message}, shared
+    # by every formatter so a record logged to several handlers is only
+    # interpolated and redacted once.
+    _cache = weakref.WeakKeyDictionary()
+
     def __init__(self, fields: List[str]):
         '''
             Constructor for the class.
@@ -46,13 +105,40 @@ class RedactingFormatter(logging.Formatter):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
 
+    def redact_message(self, record: logging.LogRecord) -> str:
+        '''
+            Returns the redacted message of a record, computing it at most
+            once per record and field list.
+        '''
+        key = (tuple(self.fields), self.REDACTION, self.SEPARATOR)
+        redacted = self._cache.get(record)
+        if redacted is None:
+            redacted = self._cache.setdefault(record, {})
+        elif key in redacted:
+            return redacted[key]
+        message = record.getMessage()
+        # Fast path: a plain field name that does not occur in the message
+        # cannot match, so the regex is skipped entirely.
+        if all(re.escape(f) == f and f not in message for f in self.fields):
+            redacted[key] = message
+        else:
+            redacted[key] = redact(self.fields, self.REDACTION,
+                                   message, self.SEPARATOR)
+        return redacted[key]
+
     def format(self, record: logging.LogRecord) -> str:
         '''
             Filter values in incoming log records using filter_datum.
+
+            The redacted message only replaces msg/args while formatting,
+            so other handlers still see the original record.
         '''
-        record.msg = filter_datum(self.fields, self.REDACTION,
-                                  record.getMessage(), self.SEPARATOR)
-        return super(RedactingFormatter, self).format(record)
+        msg, args = record.msg, record.args
+        record.msg, record.args = self.redact_message(record), None
+        try:
+            return super(RedactingFormatter, self).format(record)
+        finally:
+            record.msg, record.args = msg, args
 
 
 def get_logger() -> logging.Logger:
@@ -62,35 +148,399 @@ def get_logger() -> logging.Logger:
     logger = logging.getLogger("user_data")
     logger.setLevel(logging.INFO)
     logger.propagate = False
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
-    logger.addHandler(stream_handler)
+    if not logger.handlers:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+        logger.addHandler(stream_handler)
 
     return logger
 
 
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler with a drop or block policy when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue, block: bool = False):
+        '''
+            Constructor for the class.
+
+            Arguments:
+            log_queue: Bounded queue shared with the listener.
+            block: Wait for room when the queue is full instead of
+            dropping the record.
+        '''
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        '''
+            Freezes the message without formatting it; redaction is left
+            to the listener thread.
+        '''
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        '''
+            Puts a record on the queue according to the policy.
+        '''
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class BatchingStreamHandler(logging.StreamHandler):
+    """ StreamHandler that buffers formatted records and writes them in
+    one call once the queue it drains is empty.
+    """
+
+    def __init__(self, log_queue: queue.Queue, stream: IO[str] = None,
+                 max_batch: int = 512):
+        '''
+            Constructor for the class.
+        '''
+        super(BatchingStreamHandler, self).__init__(stream)
+        self.log_queue = log_queue
+        self.max_batch = max_batch
+        self.buffer = []
+
+    def emit(self, record: logging.LogRecord):
+        '''
+            Buffers a formatted record, flushing when the batch is full or
+            no more records are waiting.
+        '''
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.max_batch or self.log_queue.empty():
+            self.flush()
+
+    def flush(self):
+        '''
+            Writes the buffered records with a single write.
+        '''
+        self.acquire()
+        try:
+            if self.buffer:
+                self.stream.write(self.terminator.join(self.buffer) +
+                                  self.terminator)
+                self.buffer = []
+            super(BatchingStreamHandler, self).flush()
+        finally:
+            self.release()
+
+
+_ASYNC_LOGGERS: Dict[str, Tuple[BoundedQueueHandler,
+                                logging.handlers.QueueListener]] = {}
+_ASYNC_LOCK = threading.Lock()
+
+
+def get_async_logger(name: str = "user_data", maxsize: int = 10000,
+                     block: bool = False,
+                     stream: IO[str] = None) -> logging.Logger:
+    '''
+        Retrieves a non-blocking logger object.
+
+        Records are put on a bounded queue and a QueueListener thread
+        does the RedactingFormatter work and batched writes. Handlers
+        already on the logger (the synchronous one of get_logger) are
+        replaced, so records are not written twice; get_logger returns
+        the async logger from then on. Calling it again with the same
+        name returns the already configured logger.
+
+        Arguments:
+        name: Logger name.
+        maxsize: Maximum number of queued records.
+        block: Block callers when the queue is full instead of dropping.
+        stream: Output stream, sys.stderr by default.
+    '''
+    logger = logging.getLogger(name)
+    with _ASYNC_LOCK:
+        if name in _ASYNC_LOGGERS:
+            return logger
+        log_queue = queue.Queue(maxsize)
+        handler = BatchingStreamHandler(log_queue, stream)
+        handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+        queue_handler = BoundedQueueHandler(log_queue, block)
+        listener = logging.handlers.QueueListener(log_queue, handler)
+        listener.start()
+        atexit.register(listener.stop)
+
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        for old_handler in list(logger.handlers):
+            old_handler.flush()
+            logger.removeHandler(old_handler)
+        logger.addHandler(queue_handler)
+        _ASYNC_LOGGERS[name] = (queue_handler, listener)
+    return logger
+
+
+def async_logger_stats(name: str = "user_data") -> Dict[str, int]:
+    '''
+        Returns queue depth and dropped record counters of an async logger.
+    '''
+    queue_handler, _ = _ASYNC_LOGGERS[name]
+    return {"queue_depth": queue_handler.queue.qsize(),
+            "dropped": queue_handler.dropped}
+
+
+def db_config() -> Dict[str, str]:
+    '''
+        Reads the MySQL connection settings from the environment.
+    '''
+    return {"user": environ.get("PERSONAL_DATA_DB_USERNAME", "root"),
+            "password": environ.get("PERSONAL_DATA_DB_PASSWORD", ""),
+            "host": environ.get("PERSONAL_DATA_DB_HOST", "localhost"),
+            "database": environ.get("PERSONAL_DATA_DB_NAME")}
+
+
 def get_db() -> mysql.connector.connection.MySQLConnection:
     '''
         Helps establish a connection to the MySQL database.
     '''
-    username = environ.get("PERSONAL_DATA_DB_USERNAME", "root")
-    password = environ.get("PERSONAL_DATA_DB_PASSWORD", "")
-    host = environ.get("PERSONAL_DATA_DB_HOST", "localhost")
-    db_name = environ.get("PERSONAL_DATA_DB_NAME")
+    return mysql.connector.connection.MySQLConnection(**db_config())
+
+
+class ConnectionPool:
+    """ Bounded pool of reusable database connections. """
+
+    def __init__(self, connector: Callable = None, size: int = 5,
+                 max_idle: float = 300.0, **connect_kwargs):
+        '''
+            Constructor for the class.
+
+            Arguments:
+            connector: Callable returning a new connection, the MySQL
+            connection class by default.
+            size: Maximum number of connections open at the same time.
+            max_idle: Seconds after which an idle connection is closed.
+            connect_kwargs: Keyword arguments passed to the connector.
+        '''
+        if size < 1:
+            raise ValueError("size must be a positive integer")
+        if connector is None:
+            connector = mysql.connector.connection.MySQLConnection
+        self.connector = connector
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        '''
+            Checks a connection before handing it out.
+        '''
+        is_connected = getattr(conn, "is_connected", None)
+        if is_connected is None:
+            return True
+        try:
+            return bool(is_connected())
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        '''
+            Closes a connection, ignoring errors from dead ones.
+        '''
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _reset(conn) -> bool:
+        '''
+            Ends the transaction a borrower may have left open (and its
+            locks) before the connection is reused: reset_session() when
+            the connector has it, rollback() otherwise. Returns False if
+            that failed.
+        '''
+        reset = getattr(conn, "reset_session", None) or \
+            getattr(conn, "rollback", None)
+        if reset is None:
+            return True
+        try:
+            reset()
+        except Exception:
+            return False
+        return True
+
+    def evict_idle(self):
+        '''
+            Closes connections that stayed idle longer than max_idle.
+        '''
+        deadline = time.monotonic() - self.max_idle
+        expired = []
+        with self._lock:
+            # Oldest returned connections sit on the left.
+            while self._idle and self._idle[0][1] < deadline:
+                expired.append(self._idle.popleft()[0])
+        for conn in expired:
+            self._close(conn)
+
+    def acquire(self, timeout: float = None):
+        '''
+            Borrows a healthy connection, opening one if none is idle.
+            Raises TimeoutError if the pool stays exhausted for `timeout`.
+        '''
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("connection pool exhausted")
+        try:
+            self.evict_idle()
+            while True:
+                with self._lock:
+                    conn = self._idle.pop()[0] if self._idle else None
+                if conn is None:
+                    return self.connector(**self.connect_kwargs)
+                if self._healthy(conn):
+                    return conn
+                self._close(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        '''
+            Returns a borrowed connection to the pool, reset first;
+            one that cannot be reset is closed instead.
+        '''
+        try:
+            if self._reset(conn):
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            else:
+                self._close(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator:
+        '''
+            Context manager borrowing a connection for a `with` block.
+        '''
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        '''
+            Closes every idle connection.
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool(size: int = None) -> ConnectionPool:
+    '''
+        Retrieves the shared connection pool, created on first use from
+        the same environment variables as get_db. PERSONAL_DATA_DB_POOL_SIZE
+        sets its size when `size` is not given.
+    '''
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            if size is None:
+                size = int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 5))
+            _POOL = ConnectionPool(size=size, **db_config())
+            atexit.register(_POOL.close)
+        return _POOL
 
-    connect_credentials = mysql.connector.connection.MySQLConnection(
-                                                    user=username,
-                                                    password=password,
-                                                    host=host,
-                                                    database=db_name)
-    return connect_credentials
+
+def row_message(row: Sequence, field_names: List[str]) -> str:
+    '''
+        Builds the `key=value;` log line for one users row.
+    '''
+    str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, field_names))
+    return str_row.strip()
+
+
+def export_rows(cursor, stream: IO[str] = None,
+                batch_size: int = 1000) -> Tuple[int, float]:
+    '''
+        Streams an executed cursor to `stream` in redacted batches.
+
+        Rows are pulled with fetchmany so at most `batch_size` rows are
+        held in memory; each batch is formatted and written with a single
+        write call.
+
+        Arguments:
+        cursor: A DB-API cursor on which a query has been executed.
+        stream: Text stream to write to, sys.stderr by default.
+        batch_size: Number of rows fetched and written per batch.
+
+        Return:
+            Tuple of (rows written, rows per second).
+    '''
+    if stream is None:
+        stream = sys.stderr
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+    field_names = [i[0] for i in cursor.description]
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    total = 0
+    start = time.perf_counter()
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        lines = []
+        for row in rows:
+            record = logging.LogRecord("user_data", logging.INFO, __file__,
+                                       0, row_message(row, field_names),
+                                       None, None)
+            lines.append(formatter.format(record))
+        stream.write('\n'.join(lines) + '\n')
+        total += len(rows)
+    stream.flush()
+    elapsed = time.perf_counter() - start
+    return total, (total / elapsed if elapsed > 0 else 0.0)
 
 
 def main():
     '''
         Main function that retrieves user data from the database.
+
+        Set PERSONAL_DATA_EXPORT_BATCH to a positive integer to stream the
+        table with an unbuffered cursor in batches of that size instead
+        of logging row by row.
     '''
+    batch_size = environ.get("PERSONAL_DATA_EXPORT_BATCH")
     db = get_db()
+
+    if batch_size is not None:
+        cursor = db.cursor(buffered=False)
+        cursor.execute("SELECT * FROM users;")
+        total, rate = export_rows(cursor, batch_size=int(batch_size))
+        print(f'exported {total} rows ({rate:.0f} rows/sec)',
+              file=sys.stderr)
+        cursor.close()
+        db.close()
+        return
+
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
     field_names = [i[0] for i in cursor.description]
@@ -98,12 +548,111 @@ def main():
     logger = get_logger()
 
     for row in cursor:
-        str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, field_names))
-        logger.info(str_row.strip())
+        logger.info(row_message(row, field_names))
 
     cursor.close()
     db.close()
 
 
+def _line_chunks(file_path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    '''
+        Splits a file into (start, end) byte ranges of roughly
+        `chunk_size` bytes, each ending on a line boundary.
+    '''
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+    chunks = []
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                newline = mm.find(b'\n', end - 1)
+                end = size if newline == -1 else newline + 1
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _scrub_chunk(job: Tuple[str, int, int, Tuple[str, ...], str, str]
+                 ) -> bytes:
+    '''
+        Redacts one byte range of a log file (process pool worker).
+    '''
+    file_path, start, end, fields, redaction, separator = job
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8', 'surrogateescape')
+    # `.` never crosses a newline, so redacting the whole chunk is the
+    # same as redacting it line by line.
+    return redact(list(fields), redaction, text,
+                  separator).encode('utf-8', 'surrogateescape')
+
+
+def scrub_file(src: str, dst: IO[bytes], fields: List[str] = PII_FIELDS,
+               redaction: str = RedactingFormatter.REDACTION,
+               separator: str = RedactingFormatter.SEPARATOR,
+               workers: int = None, chunk_size: int = 8 << 20) -> int:
+    '''
+        Redacts a `key=value;` log file in parallel.
+
+        The file is memory-mapped and split on line boundaries; chunks
+        are redacted in a process pool and written to `dst` in order.
+
+        Arguments:
+        src: Path of the log file to scrub.
+        dst: Binary stream receiving the scrubbed file.
+        fields: Fields to obfuscate, PII_FIELDS by default.
+        redaction: Redaction token, RedactingFormatter.REDACTION by default.
+        separator: Field separator, RedactingFormatter.SEPARATOR by default.
+        workers: Number of processes, os.cpu_count() by default.
+        chunk_size: Approximate number of bytes per chunk.
+
+        Return:
+            Number of bytes written.
+    '''
+    jobs = [(src, start, end, tuple(fields), redaction, separator)
+            for start, end in _line_chunks(src, chunk_size)]
+    if workers == 1 or len(jobs) <= 1:
+        return sum(dst.write(data) for data in map(_scrub_chunk, jobs))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(dst.write(data)
+                   for data in executor.map(_scrub_chunk, jobs))
+
+
+def scrub_main(argv: List[str] = None):
+    '''
+        Command line entry point for scrubbing existing log files.
+    '''
+    parser = argparse.ArgumentParser(
+        prog="filtered_logger.py scrub",
+        description="Redact PII fields from key=value; log files.")
+    parser.add_argument("src", help="log file to scrub")
+    parser.add_argument("-o", "--output",
+                        help="output file (stdout by default)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument("-f", "--fields", default=",".join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument("--chunk-size", type=int, default=8 << 20,
+                        help="approximate bytes per chunk")
+    args = parser.parse_args(argv)
+    fields = [f for f in args.fields.split(",") if f]
+
+    if args.output is None:
+        scrub_file(args.src, sys.stdout.buffer, fields,
+                   workers=args.workers, chunk_size=args.chunk_size)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, 'wb') as dst:
+            scrub_file(args.src, dst, fields,
+                       workers=args.workers, chunk_size=args.chunk_size)
+
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'scrub':
+        scrub_main(sys.argv[2:])
+    else:
+        main()
@@ -7,13 +7,17 @@ from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import CORS
 import os
-from api.v1.auth.auth import Auth
+from api.v1.auth.auth import Auth, PathMatcher, request_user
 
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
+EXCLUDED_PATHS = PathMatcher(['/api/v1/status/',
+                              '/api/v1/unauthorized/',
+                              '/api/v1/forbidden/',
+                              '/api/v1/auth_session/login/'])
 
 
 # Get the authentication type from environment variables
@@ -21,8 +25,14 @@ AUTH_TYPE = os.getenv("AUTH_TYPE")
 
 # Set up authentication based on the chosen AUTH_TYPE
 if os.getenv("AUTH_TYPE") == 'session_auth':
-    from api.v1.auth.auth import SessionAuth
+    from api.v1.auth.session_auth import SessionAuth
     auth = SessionAuth()
+elif AUTH_TYPE == 'session_exp_auth':
+    from api.v1.auth.session_exp_auth import SessionExpAuth
+    auth = SessionExpAuth()
+elif AUTH_TYPE == 'session_db_auth':
+    from api.v1.auth.session_db_auth import SessionDBAuth
+    auth = SessionDBAuth()
 else:
     if AUTH_TYPE == 'auth':
         from api.v1.auth.auth import Auth
@@ -30,30 +40,31 @@ else:
     elif AUTH_TYPE == 'basic_auth':
         from api.v1.auth.basic_auth import BasicAuth
         auth = BasicAuth()
+app.extensions["auth"] = auth
 
 
 @app.before_request
 def before_request():
     '''
     Function that helps filter requests
+
+    The user is resolved once, by request_user(), and only for paths
+    requiring authentication; views of other paths can call
+    request_user() if they need it.
     '''
+    request.current_user = None
     if auth is not None:
-        excluded_list = ['/api/v1/status/',
-                         '/api/v1/unauthorized/',
-                         '/api/v1/forbidden/',
-                         '/api/v1/auth_session/login/']
-
         # Check if authentication is required for the request path
-        if auth.require_auth(request.path, excluded_list):
+        if auth.require_auth(request.path, EXCLUDED_PATHS):
             # Check if authorization header is missing
             if (auth.authorization_header(request) is None and
                     auth.session_cookie(request) is None):
 
                 abort(401, description="Unauthorized")
             # Check if user is not authorized
-            if auth.current_user(request) is None:
+            request.current_user = request_user()
+            if request.current_user is None:
                 abort(403, description='Forbidden')
-    request.current_user = auth.current_user(request)
 
 
 @app.errorhandler(401)
@@ -2,9 +2,82 @@
 '''
 Module defining the Auth class
 '''
-from flask import request
+from flask import current_app, g, has_request_context, request
+from functools import lru_cache
 import os
-from typing import List, TypeVar
+from typing import List, TypeVar, Union
+
+
+def request_user() -> TypeVar('User'):
+    '''
+    Returns the user of the request being served, resolved by the auth
+    of the app (app.extensions["auth"]) at most once per request and
+    kept on flask.g. None without auth or outside of a request.
+    '''
+    if not has_request_context():
+        return None
+    if "current_user" not in g:
+        auth = current_app.extensions.get("auth")
+        g.current_user = None if auth is None else auth.current_user(request)
+    return g.current_user
+
+
+class PathMatcher:
+    '''
+    Excluded paths of Auth.require_auth compiled once
+
+    A rule ending with "*" excludes the paths starting with what precedes
+    it. Any other rule, without its trailing "/", excludes itself and
+    the paths below it (followed by "/"). Prefixes are kept in hash sets
+    by length and path rules in one hash set probed at each "/" of the
+    path, and recent decisions are memoized in an LRU cache.
+    '''
+
+    def __init__(self, excluded_paths: List[str], memo_size: int = 1024):
+        '''
+        Compiles excluded_paths
+        '''
+        self.excluded_paths = list(excluded_paths)
+        self._bases = set()
+        self._prefixes = {}
+        for rule in map(str.strip, self.excluded_paths):
+            if rule.endswith('*'):
+                self._prefixes.setdefault(len(rule) - 1, set()).add(
+                    rule[:-1])
+            elif rule.endswith('/'):
+                self._bases.add(rule[:-1])
+            else:
+                self._bases.add(rule)
+        self._max_base = max(map(len, self._bases), default=-1)
+        self._prefix_lengths = sorted(self._prefixes)
+        self.excluded = lru_cache(maxsize=memo_size)(self._excluded)
+
+    def _excluded(self, path: str) -> bool:
+        '''
+        Returns True if a rule excludes path
+        '''
+        bases = self._bases
+        if path in bases:
+            return True
+        i = path.find('/')
+        while 0 <= i <= self._max_base:
+            if path[:i] in bases:
+                return True
+            i = path.find('/', i + 1)
+        for length in self._prefix_lengths:
+            if length > len(path):
+                break
+            if path[:length] in self._prefixes[length]:
+                return True
+        return False
+
+
+@lru_cache(maxsize=32)
+def _path_matcher(excluded_paths: tuple) -> PathMatcher:
+    '''
+    PathMatcher of an excluded_paths list passed to require_auth
+    '''
+    return PathMatcher(excluded_paths)
 
 
 class Auth:
@@ -15,29 +88,18 @@ class Auth:
     def require_auth(
             self,
             path: str,
-            excluded_paths: List[str]
+            excluded_paths: Union[List[str], PathMatcher]
             ) -> bool:
         '''
-        Returns False - path and excluded_paths
-        will be used later, now, you don't need
-        to take care of them
+        Returns False if path is excluded from authentication by
+        excluded_paths, a list of rules (compiled on first use) or a
+        PathMatcher built once
         '''
-        if path is not None and excluded_paths is not None:
-            for exclusion_path in map(str.strip, excluded_paths):
-                pattern = ''
-                if exclusion_path.endswith('*'):
-                    pattern = exclusion_path[:-1]
-                    if path.startswith(pattern):
-                        return False
-                elif exclusion_path.endswith('/'):
-                    pattern = exclusion_path[:-1]
-                    if path == pattern or path.startswith(pattern + '/'):
-                        return False
-                else:
-                    pattern = exclusion_path
-                    if path == pattern or path.startswith(pattern + '/'):
-                        return False
-        return True
+        if path is None or excluded_paths is None:
+            return True
+        if not isinstance(excluded_paths, PathMatcher):
+            excluded_paths = _path_matcher(tuple(excluded_paths))
+        return not excluded_paths.excluded(path)
 
     def authorization_header(self, request=None) -> str:
         '''
@@ -4,18 +4,164 @@ Module defining the BasicAuth class for basic authentication.
 '''
 from api.v1.auth.auth import Auth
 import base64
-from typing import TypeVar
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, TypeVar
 
 from models.user import User
 
 T = TypeVar('T')
 
 
+class CredentialCache:
+    '''
+    Bounded LRU cache of verified Basic credentials, with a TTL.
+
+    Entries are keyed by a keyed BLAKE2 hash of the raw Authorization
+    header (the secret is random per process, so the header can't be
+    recovered from the cache) and hold the user id together with the
+    email and password hash the header was verified against. A hit is
+    only served while the user still has both, so a password or email
+    change invalidates it even before the User events below drop it.
+    Failed authentications are never cached.
+    '''
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        """
+        Creates an empty cache and subscribes to User changes.
+
+        Args:
+            max_size (int): Maximum number of entries, the least recently
+            used one being evicted first.
+            ttl (float): Seconds an entry stays valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        User.on_save(self._on_user_change)
+        User.on_remove(self._on_user_change)
+        User.on_load(self._on_users_load)
+
+    def key(self, authorization_header: str) -> bytes:
+        """
+        Keyed hash of a raw Authorization header.
+        """
+        return hashlib.blake2b(authorization_header.encode(),
+                               key=self._secret, digest_size=16).digest()
+
+    def get(self, key: bytes) -> TypeVar('User'):
+        """
+        Returns the user cached for a header key, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            # User.get may fire User events, so it runs without the lock
+            user_id, email, password, expires = entry
+            user = User.get(user_id)
+            if user is not None and time.monotonic() < expires and \
+                    user.email == email and user.password == password:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return user
+        with self._lock:
+            if entry is not None and self._entries.get(key) is entry:
+                self._drop(key)
+            self.misses += 1
+        return None
+
+    def put(self, key: bytes, user: TypeVar('User')):
+        """
+        Caches the user verified for a header key.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (user.id, user.email, user.password,
+                                  time.monotonic() + self.ttl)
+            self._by_user.setdefault(user.id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the cache size and its hit/miss counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, key: bytes):
+        """
+        Removes one entry (lock held).
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_user.get(entry[0])
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry[0]]
+
+    def _on_user_change(self, cls: type, user_id: str, version: int):
+        """
+        Drops the entries of a saved or removed user.
+        """
+        with self._lock:
+            for key in tuple(self._by_user.get(user_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def _on_users_load(self, cls: type, user_id: str, version: int):
+        """
+        Drops every entry when users are reloaded.
+        """
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_user.clear()
+
+
 class BasicAuth(Auth):
     '''
     Definition of the BasicAuth class, a subclass of Auth for basic
     authentication.
+
+    Verified credentials are kept in `credential_cache`, sized by the
+    BASIC_AUTH_CACHE_SIZE (entries, 0 disables it) and
+    BASIC_AUTH_CACHE_TTL (seconds) environment variables.
     '''
+    credential_cache = CredentialCache(
+        int(os.getenv("BASIC_AUTH_CACHE_SIZE", "1024")),
+        float(os.getenv("BASIC_AUTH_CACHE_TTL", "300")))
+
     def extract_base64_authorization_header(
             self,
             authorization_header: str
@@ -158,13 +304,21 @@ class BasicAuth(Auth):
         """
         auth_header = self.authorization_header(request)
         if auth_header is not None:
+            cache = self.credential_cache
+            key = cache.key(auth_header)
+            user = cache.get(key)
+            if user is not None:
+                return user
             token = self.extract_base64_authorization_header(auth_header)
             if token is not None:
                 decoded = self.decode_base64_authorization_header(token)
                 if decoded is not None:
                     email, password = self.extract_user_credentials(decoded)
                     if email is not None:
-                        return self.user_object_from_credentials(
+                        user = self.user_object_from_credentials(
                             email, password)
+                        if user is not None:
+                            cache.put(key, user)
+                        return user
 
         return None
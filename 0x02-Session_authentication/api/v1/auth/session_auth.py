@@ -4,14 +4,18 @@
 from flask import request
 from typing import List, TypeVar
 from api.v1.auth.auth import Auth
-from models import User
+from api.v1.auth.session_store import SessionStoreFull, get_session_store
+from models.user import User
 import uuid
 
 
 class SessionAuth(Auth):
     """ Session Authentication class
+
+    Sessions are kept in the store chosen by SESSION_STORE, see
+    api.v1.auth.session_store.
     """
-    user_id_by_session_id = {}
+    user_id_by_session_id = get_session_store()
 
     def create_session(self, user_id: str = None) -> str:
         """ Create a Session ID for a user_id
@@ -22,8 +26,12 @@ class SessionAuth(Auth):
         # Generate a Session ID using uuid
         session_id = str(uuid.uuid4())
 
-        # Store the user_id mapped to the session_id
-        self.user_id_by_session_id[session_id] = user_id
+        # Store the user_id mapped to the session_id (None when the
+        # store has no room left)
+        try:
+            self.user_id_by_session_id[session_id] = user_id
+        except SessionStoreFull:
+            return None
         return session_id
 
     def user_id_for_session_id(self, session_id: str = None) -> str:
@@ -57,9 +65,8 @@ class SessionAuth(Auth):
         if user_id is None:
             return False
 
-        # Delete the Session ID from the dictionary
-        del self.user_id_by_session_id[session_id]
-        return True
+        # Delete the Session ID from the store
+        return self.user_id_by_session_id.delete(session_id)
 
     def current_user(self, request=None):
         """
@@ -3,9 +3,11 @@
 """
 
 from api.v1.auth.session_exp_auth import SessionExpAuth
+from models.query import In
 from models.user_session import UserSession
 from models.user import User
-from datetime import datetime, timedelta
+from datetime import timezone
+import time
 
 
 class SessionDBAuth(SessionExpAuth):
@@ -45,20 +47,56 @@ class SessionDBAuth(SessionExpAuth):
             return None
 
         # Query UserSession model to get user_id based on session_id
-        user_session = UserSession.search({'session_id': session_id})
+        user_session = UserSession.first({'session_id': session_id})
         if user_session is None:
+            self.expiry_index.discard(session_id)
             return None
 
         # Check session expiration
-        if self.session_duration > 0:
-            created_at = user_session.created_at
-            expiration_time = created_at + \
-                timedelta(seconds=self.session_duration)
-            if expiration_time < datetime.now():
-                return None
+        if self.session_duration <= 0:
+            return user_session.user_id
+
+        deadline = self.expiry_index.deadline(session_id)
+        if deadline is None:
+            deadline = self._index_session(session_id,
+                                           self._created_at(user_session))
+        if deadline < time.monotonic():
+            if self._evict_session(session_id):
+                self.evicted_on_lookup += 1
+            return None
 
         return user_session.user_id
 
+    @staticmethod
+    def _created_at(user_session):
+        """ Creation time of a UserSession in epoch seconds (created_at
+        is naive UTC)
+        """
+        return user_session.created_at.replace(
+            tzinfo=timezone.utc).timestamp()
+
+    def _index_stored(self):
+        """ Index the stored sessions, including the UserSession rows
+        loaded from the database
+        """
+        super()._index_stored()
+        for user_session in UserSession.all():
+            session_id = user_session.session_id
+            if session_id is not None and \
+                    self.expiry_index.deadline(session_id) is None:
+                self._index_session(session_id,
+                                    self._created_at(user_session))
+
+    def _evict_sessions(self, session_ids):
+        """ Remove expired sessions from the session store and the
+        database (UserSession), the latter with a single write.
+        """
+        evicted = super()._evict_sessions(session_ids)
+        user_sessions = UserSession.search({'session_id': In(session_ids)})
+        removed = UserSession.bulk_remove(
+            [user_session.id for user_session in user_sessions])
+        return max(evicted, len(removed))
+
     def destroy_session(self, request=None):
         """ Destroy the UserSession based on the Session
         ID from the request cookie.
@@ -79,10 +117,10 @@ class SessionDBAuth(SessionExpAuth):
             return False
 
         # Query UserSession model to get the user session
-        user_session = UserSession.search({'session_id': session_id})
+        user_session = UserSession.first({'session_id': session_id})
         if user_session is None:
             return False
 
         # Delete the user session from the database
-        user_session.delete()
+        user_session.remove()
         return True
@@ -4,12 +4,89 @@
 """
 
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+from typing import Dict, List, Optional
 from api.v1.auth.session_auth import SessionAuth
 
 
+class ExpiryIndex:
+    """ Timing wheel of session deadlines, in time.monotonic() seconds
+
+    Deadlines are bucketed by tick of `resolution` seconds and the buckets
+    are emptied in tick order, so adding a session is one append and each
+    expired session is popped once: eviction is amortized O(1). A session
+    discarded or re-added leaves a stale entry in its old bucket, skipped
+    when that bucket is emptied.
+    """
+
+    def __init__(self, resolution: float = 1.0):
+        """ Create an empty index """
+        self.resolution = resolution
+        self._lock = threading.Lock()
+        self._deadlines = {}
+        self._buckets = {}
+        self._cursor = None
+
+    def add(self, session_id: str, deadline: float):
+        """ Index (or re-index) a session expiring at deadline """
+        tick = int(deadline // self.resolution)
+        with self._lock:
+            self._deadlines[session_id] = deadline
+            self._buckets.setdefault(tick, []).append(session_id)
+            if self._cursor is None or tick < self._cursor:
+                self._cursor = tick
+
+    def deadline(self, session_id: str) -> Optional[float]:
+        """ Deadline of an indexed session, or None """
+        return self._deadlines.get(session_id)
+
+    def discard(self, session_id: str):
+        """ Forget a session """
+        with self._lock:
+            self._deadlines.pop(session_id, None)
+
+    def pop_expired(self, now: float, limit: int) -> List[str]:
+        """ Remove and return up to `limit` sessions of the ticks that
+        ended before `now`, earliest first
+        """
+        expired = []
+        with self._lock:
+            last = int(now // self.resolution) - 1
+            while self._cursor is not None and self._cursor <= last \
+                    and len(expired) < limit:
+                bucket = self._buckets.get(self._cursor)
+                while bucket and len(expired) < limit:
+                    session_id = bucket.pop()
+                    deadline = self._deadlines.get(session_id)
+                    if deadline is not None and \
+                            int(deadline // self.resolution) == self._cursor:
+                        del self._deadlines[session_id]
+                        expired.append(session_id)
+                if bucket:
+                    break
+                self._buckets.pop(self._cursor, None)
+                if self._buckets:
+                    self._cursor += 1
+                else:
+                    self._cursor = None
+        return expired
+
+    def __len__(self) -> int:
+        """ Number of indexed sessions """
+        return len(self._deadlines)
+
+
 class SessionExpAuth(SessionAuth):
-    """ Session Authentication class with expiration """
+    """ Session Authentication class with expiration
+
+    Sessions are indexed by deadline (monotonic clock) in an ExpiryIndex.
+    A background sweeper evicts the expired ones from the session store
+    every SESSION_SWEEP_INTERVAL seconds (60, 0 disables it), at most
+    SESSION_SWEEP_MAX (1000) per sweep so that a sweep stays short; a
+    sweep reaching the cap is followed by another one after a tenth of
+    the interval. Lookups evict an expired session right away.
+    """
 
     def __init__(self):
         """ Initialize SessionExpAuth """
@@ -20,6 +97,18 @@ class SessionExpAuth(SessionAuth):
             self.session_duration = int(session_duration_str)
         except (TypeError, ValueError):
             self.session_duration = 0
+        self.expiry_index = ExpiryIndex()
+        self.sweep_interval = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+        self.sweep_max = int(os.getenv("SESSION_SWEEP_MAX", "1000"))
+        self.evicted = 0
+        self.evicted_on_lookup = 0
+        self.sweeps = 0
+        self.last_sweep_ms = 0.0
+        self.max_sweep_ms = 0.0
+        self._sweeper = None
+        self._stop = threading.Event()
+        if self.session_duration > 0 and self.sweep_interval > 0:
+            self.start_sweeper()
 
     def create_session(self, user_id=None):
         """ Create a Session ID with expiration.
@@ -30,16 +119,11 @@ class SessionExpAuth(SessionAuth):
         Returns:
             str: The Session ID if created successfully, None otherwise.
         """
+        # The session store records the creation time of the session
         session_id = super().create_session(user_id)
-        if session_id is None:
-            return None
-
-        # Create session dictionary
-        session_dict = {
-            'user_id': user_id,
-            'created_at': datetime.now()
-        }
-        self.user_id_by_session_id[session_id] = session_dict
+        if session_id is not None and self.session_duration > 0:
+            self.expiry_index.add(session_id,
+                                  time.monotonic() + self.session_duration)
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
@@ -52,22 +136,124 @@ class SessionExpAuth(SessionAuth):
             str: The User ID if the session is valid and active,
             None otherwise.
         """
-        if session_id is None or session_id not in self.user_id_by_session_id:
+        if session_id is None or not isinstance(session_id, str):
             return None
 
-        session_dict = self.user_id_by_session_id[session_id]
-        user_id = session_dict.get('user_id')
+        record = self.user_id_by_session_id.record(session_id)
+        if record is None:
+            self.expiry_index.discard(session_id)
+            return None
+        user_id, created_at = record
 
         # Check session expiration
         if self.session_duration <= 0:
             return user_id
 
-        created_at = session_dict.get('created_at')
-        if created_at is None:
-            return None
-
-        expiration_time = created_at + timedelta(seconds=self.session_duration)
-        if expiration_time < datetime.now():
+        deadline = self.expiry_index.deadline(session_id)
+        if deadline is None:
+            deadline = self._index_session(session_id, created_at)
+        if deadline < time.monotonic():
+            if self._evict_session(session_id):
+                self.evicted_on_lookup += 1
             return None
 
         return user_id
+
+    def destroy_session(self, request=None):
+        """ Delete the user session / logout, and unindex it """
+        session_id = self.session_cookie(request) if request else None
+        destroyed = super().destroy_session(request)
+        if destroyed:
+            self.expiry_index.discard(session_id)
+        return destroyed
+
+    def _index_session(self, session_id: str, created_at: float) -> float:
+        """ Index a session this process did not create (another worker
+        of a shared store, or before a restart), carrying its remaining
+        wall-clock lifetime over to the monotonic clock
+        """
+        deadline = time.monotonic() + \
+            created_at + self.session_duration - time.time()
+        self.expiry_index.add(session_id, deadline)
+        return deadline
+
+    def _evict_session(self, session_id: str) -> bool:
+        """ Remove an expired session, True if it was still stored """
+        return self._evict_sessions([session_id]) > 0
+
+    def _evict_sessions(self, session_ids: List[str]) -> int:
+        """ Remove expired sessions and return how many were still
+        stored
+        """
+        evicted = 0
+        for session_id in session_ids:
+            self.expiry_index.discard(session_id)
+            if self.user_id_by_session_id.delete(session_id):
+                evicted += 1
+        return evicted
+
+    def sweep(self) -> int:
+        """ Evict up to sweep_max expired sessions and return how many
+        expired sessions were taken from the index
+        """
+        start = time.perf_counter()
+        expired = self.expiry_index.pop_expired(time.monotonic(),
+                                                self.sweep_max)
+        evicted = self._evict_sessions(expired) if expired else 0
+        elapsed = (time.perf_counter() - start) * 1000
+        self.evicted += evicted
+        self.sweeps += 1
+        self.last_sweep_ms = elapsed
+        self.max_sweep_ms = max(self.max_sweep_ms, elapsed)
+        return len(expired)
+
+    def start_sweeper(self):
+        """ Start the background sweeper thread """
+        if self._sweeper is not None:
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop,
+                                         daemon=True, name="session-sweeper")
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        """ Stop the background sweeper thread """
+        if self._sweeper is None:
+            return
+        self._stop.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    def _index_stored(self):
+        """ Index the sessions already stored (shared or persistent
+        stores) that are not indexed yet
+        """
+        for session_id in self.user_id_by_session_id:
+            if self.expiry_index.deadline(session_id) is None:
+                record = self.user_id_by_session_id.record(session_id)
+                if record is not None:
+                    self._index_session(session_id, record[1])
+
+    def _sweep_loop(self):
+        """ Sweeper thread: index the sessions already stored, then sweep
+        every sweep_interval
+        """
+        self._index_stored()
+        interval = self.sweep_interval
+        while not self._stop.wait(interval):
+            if self.sweep() >= self.sweep_max:
+                interval = self.sweep_interval / 10
+            else:
+                interval = self.sweep_interval
+
+    def stats(self) -> Dict[str, float]:
+        """ Live and evicted session counters """
+        return {
+            "live": len(self.user_id_by_session_id),
+            "indexed": len(self.expiry_index),
+            "evicted": self.evicted,
+            "evicted_on_lookup": self.evicted_on_lookup,
+            "sweeps": self.sweeps,
+            "last_sweep_ms": self.last_sweep_ms,
+            "max_sweep_ms": self.max_sweep_ms,
+        }
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+""" Session stores module
+
+A session store maps session IDs to user IDs and remembers when each
+session was created. SessionAuth keeps its sessions in the store chosen
+by the SESSION_STORE environment variable:
+- `memory` (default): in-process dict split into lock-striped shards
+- `sqlite`: SQLite database shared by the local worker processes
+- `file`: memory-mapped hash table file shared by the local workers
+"""
+from collections.abc import MutableMapping
+import fcntl
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+
+class SessionStoreFull(Exception):
+    """ Raised when a session store has no room for a new session
+    """
+
+
+class SessionStore(MutableMapping):
+    """ Session store interface: a mapping of session ID -> user ID
+
+    Setting a session records its creation time (epoch seconds), which
+    `record` returns along with the user ID.
+    """
+
+    def record(self, session_id: str) -> Optional[Tuple[str, float]]:
+        """ (user ID, creation time) of a session, or None
+        """
+        raise NotImplementedError()
+
+    def delete(self, session_id: str) -> bool:
+        """ Remove a session, True if it existed
+        """
+        raise NotImplementedError()
+
+    def get(self, session_id: str, default: str = None) -> str:
+        """ User ID of a session, or default
+        """
+        record = self.record(session_id)
+        return default if record is None else record[0]
+
+    def __getitem__(self, session_id: str) -> str:
+        """ User ID of a session
+        """
+        record = self.record(session_id)
+        if record is None:
+            raise KeyError(session_id)
+        return record[0]
+
+    def __delitem__(self, session_id: str):
+        """ Remove a session
+        """
+        if not self.delete(session_id):
+            raise KeyError(session_id)
+
+
+class ShardedSessionStore(SessionStore):
+    """ In-process store split into `shards` dicts, each with its own
+    lock, so concurrent requests rarely wait on each other
+    """
+
+    def __init__(self, shards: int = 16):
+        """ Create the empty shards
+        """
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def _shard(self, session_id: str) -> Tuple[dict, threading.Lock]:
+        """ Shard holding a session ID
+        """
+        return self._shards[hash(session_id) % len(self._shards)]
+
+    def __setitem__(self, session_id: str, user_id: str):
+        """ Create (or replace) a session
+        """
+        sessions, lock = self._shard(session_id)
+        with lock:
+            sessions[session_id] = (user_id, time.time())
+
+    def record(self, session_id: str) -> Optional[Tuple[str, float]]:
+        """ (user ID, creation time) of a session, or None
+        """
+        return self._shard(session_id)[0].get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        """ Remove a session, True if it existed
+        """
+        sessions, lock = self._shard(session_id)
+        with lock:
+            return sessions.pop(session_id, None) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over a copy of the session IDs
+        """
+        ids = []
+        for sessions, lock in self._shards:
+            with lock:
+                ids.extend(sessions)
+        return iter(ids)
+
+    def __len__(self) -> int:
+        """ Number of sessions
+        """
+        return sum(len(sessions) for sessions, _ in self._shards)
+
+
+class SQLiteSessionStore(SessionStore):
+    """ Sessions in an SQLite database (WAL mode) that every local worker
+    process opens, surviving restarts
+    """
+
+    def __init__(self, db_path: str = ".sessions.sqlite3"):
+        """ Open (and create if needed) the database
+        """
+        self.db_path = db_path
+        self._pid = None
+        self._db()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, "
+                "created_at REAL NOT NULL)")
+
+    def _db(self) -> sqlite3.Connection:
+        """ Connection of the current process, reopened after a fork
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._lock = threading.Lock()
+            self._conn = sqlite3.connect(self.db_path,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+
+    def __setitem__(self, session_id: str, user_id: str):
+        """ Create (or replace) a session
+        """
+        conn = self._db()
+        with self._lock, conn:
+            conn.execute("INSERT OR REPLACE INTO sessions "
+                         "(id, user_id, created_at) VALUES (?, ?, ?)",
+                         (session_id, user_id, time.time()))
+
+    def record(self, session_id: str) -> Optional[Tuple[str, float]]:
+        """ (user ID, creation time) of a session, or None
+        """
+        conn = self._db()
+        with self._lock:
+            return conn.execute(
+                "SELECT user_id, created_at FROM sessions WHERE id = ?",
+                (session_id,)).fetchone()
+
+    def delete(self, session_id: str) -> bool:
+        """ Remove a session, True if it existed
+        """
+        conn = self._db()
+        with self._lock, conn:
+            return conn.execute("DELETE FROM sessions WHERE id = ?",
+                                (session_id,)).rowcount > 0
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over the session IDs
+        """
+        conn = self._db()
+        with self._lock:
+            rows = conn.execute("SELECT id FROM sessions").fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        """ Number of sessions
+        """
+        conn = self._db()
+        with self._lock:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class FileSessionStore(SessionStore):
+    """ Fixed-size open-addressing hash table in a memory-mapped file that
+    all local worker processes map
+
+    Each of the `slots` slots holds a state byte, the creation time and
+    the session and user IDs (up to 64 bytes each). Slots are found by
+    linear probing from a BLAKE2 hash of the session ID, which unlike
+    hash() is the same in every process. Readers take a shared flock on
+    the file and writers an exclusive one. Removing a session shifts the
+    rest of its probe cluster back (backward-shift deletion), so the
+    table never fills with tombstones and a miss stops at the first empty
+    slot. At most MAX_LOAD of the slots are used: past that, adding a
+    session raises SessionStoreFull.
+    """
+
+    MAGIC = b"SESS0001"
+    HEADER = struct.Struct("<8sII")
+    SLOT = struct.Struct("<Bd64s64s")
+    # DELETED (tombstone) slots are only found in files written by older
+    # versions, and are reclaimed when the file is mapped
+    EMPTY, USED, DELETED = 0, 1, 2
+    MAX_LOAD = 0.9
+
+    def __init__(self, file_path: str = ".sessions.db", slots: int = 65536):
+        """ Create the file, or map the existing one (keeping its size)
+        """
+        self.file_path = file_path
+        self.slots = slots
+        self._pid = None
+        self._map()
+
+    def _map(self) -> mmap.mmap:
+        """ Mapping of the current process, reopened after a fork so the
+        flocks of parent and child processes exclude each other
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._mm
+        self._pid = pid
+        self._lock = threading.RLock()
+        fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, self.HEADER.size, 0)
+            if len(header) == self.HEADER.size and \
+                    header[:8] == self.MAGIC:
+                self.slots = self.HEADER.unpack(header)[1]
+            else:
+                os.ftruncate(fd, self.HEADER.size +
+                             self.slots * self.SLOT.size)
+                os.pwrite(fd, self.HEADER.pack(self.MAGIC, self.slots, 0),
+                          0)
+            self._mm = mmap.mmap(fd, self.HEADER.size +
+                                 self.slots * self.SLOT.size)
+            self._reclaim()
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        return self._mm
+
+    def _locked(self, exclusive: bool) -> '_FileLock':
+        """ Context manager holding the thread and file locks
+        """
+        self._map()
+        return _FileLock(self, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def _offset(self, slot: int) -> int:
+        """ Byte offset of a slot
+        """
+        return self.HEADER.size + slot * self.SLOT.size
+
+    def _home(self, key: bytes) -> int:
+        """ First slot of the probe path of a key
+        """
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                              "little") % self.slots
+
+    def _find(self, key: bytes) -> Tuple[Optional[int], Optional[int]]:
+        """ (slot holding key or None, empty slot ending its probe path
+        or None) (lock held)
+        """
+        start = self._home(key)
+        for i in range(self.slots):
+            slot = (start + i) % self.slots
+            state, _, sid, _ = self.SLOT.unpack_from(self._mm,
+                                                     self._offset(slot))
+            if state == self.EMPTY:
+                return None, slot
+            if state == self.USED and sid.rstrip(b"\0") == key:
+                return slot, None
+        return None, None
+
+    def _clear(self, slot: int):
+        """ Empty a slot and shift the following entries of its cluster
+        back so that no probe path crosses the hole (lock held)
+        """
+        hole = slot
+        while True:
+            slot = (slot + 1) % self.slots
+            entry = self.SLOT.unpack_from(self._mm, self._offset(slot))
+            if entry[0] == self.EMPTY:
+                break
+            # An entry stays put if its home slot is cyclically in
+            # (hole, slot]: the hole is not on its probe path
+            home = self._home(entry[2].rstrip(b"\0"))
+            if (home - hole - 1) % self.slots < (slot - hole) % self.slots:
+                continue
+            self.SLOT.pack_into(self._mm, self._offset(hole), *entry)
+            hole = slot
+        self.SLOT.pack_into(self._mm, self._offset(hole), self.EMPTY,
+                            0.0, b"", b"")
+
+    def _reclaim(self):
+        """ Rebuild the table if it holds tombstones left by an older
+        version (exclusive file lock held)
+        """
+        entries = []
+        tombstones = False
+        for slot in range(self.slots):
+            entry = self.SLOT.unpack_from(self._mm, self._offset(slot))
+            if entry[0] == self.USED:
+                entries.append(entry)
+            elif entry[0] == self.DELETED:
+                tombstones = True
+        if not tombstones:
+            return
+        empty = self.SLOT.pack(self.EMPTY, 0.0, b"", b"")
+        self._mm[self.HEADER.size:] = empty * self.slots
+        for entry in entries:
+            _, free = self._find(entry[2].rstrip(b"\0"))
+            self.SLOT.pack_into(self._mm, self._offset(free), *entry)
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.slots,
+                              len(entries))
+
+    def _count(self, delta: int):
+        """ Update the session count of the header (lock held)
+        """
+        magic, slots, count = self.HEADER.unpack_from(self._mm, 0)
+        self.HEADER.pack_into(self._mm, 0, magic, slots, count + delta)
+
+    @staticmethod
+    def _encode(value: str) -> bytes:
+        """ UTF-8 bytes of an ID, which must fit in a slot
+        """
+        data = value.encode()
+        if len(data) > 64 or b"\0" in data:
+            raise ValueError("ID too long for a session slot: {}"
+                             .format(value))
+        return data
+
+    def __setitem__(self, session_id: str, user_id: str):
+        """ Create (or replace) a session
+        """
+        key = self._encode(session_id)
+        value = self._encode(user_id)
+        with self._locked(True):
+            slot, free = self._find(key)
+            if slot is None:
+                count = self.HEADER.unpack_from(self._mm, 0)[2]
+                if free is None or count + 1 > self.MAX_LOAD * self.slots:
+                    raise SessionStoreFull("session store is full ({} of {} "
+                                           "slots used)"
+                                           .format(count, self.slots))
+                slot = free
+                self._count(1)
+            self.SLOT.pack_into(self._mm, self._offset(slot), self.USED,
+                                time.time(), key, value)
+
+    def record(self, session_id: str) -> Optional[Tuple[str, float]]:
+        """ (user ID, creation time) of a session, or None
+        """
+        try:
+            key = self._encode(session_id)
+        except ValueError:
+            return None
+        with self._locked(False):
+            slot, _ = self._find(key)
+            if slot is None:
+                return None
+            _, created_at, _, user_id = self.SLOT.unpack_from(
+                self._mm, self._offset(slot))
+        return user_id.rstrip(b"\0").decode(), created_at
+
+    def delete(self, session_id: str) -> bool:
+        """ Remove a session, True if it existed
+        """
+        try:
+            key = self._encode(session_id)
+        except ValueError:
+            return False
+        with self._locked(True):
+            slot, _ = self._find(key)
+            if slot is None:
+                return False
+            self._clear(slot)
+            self._count(-1)
+            return True
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over a copy of the session IDs
+        """
+        ids = []
+        with self._locked(False):
+            for slot in range(self.slots):
+                state, _, sid, _ = self.SLOT.unpack_from(self._mm,
+                                                         self._offset(slot))
+                if state == self.USED:
+                    ids.append(sid.rstrip(b"\0").decode())
+        return iter(ids)
+
+    def __len__(self) -> int:
+        """ Number of sessions
+        """
+        with self._locked(False):
+            return self.HEADER.unpack_from(self._mm, 0)[2]
+
+
+class _FileLock():
+    """ Thread lock plus flock of a FileSessionStore
+    """
+
+    def __init__(self, store: FileSessionStore, operation: int):
+        """ Lock to take on enter
+        """
+        self.store = store
+        self.operation = operation
+
+    def __enter__(self):
+        """ Take the thread lock, then the file lock
+        """
+        self.store._lock.acquire()
+        try:
+            fcntl.flock(self.store._fd, self.operation)
+        except BaseException:
+            self.store._lock.release()
+            raise
+
+    def __exit__(self, *args):
+        """ Release both locks
+        """
+        fcntl.flock(self.store._fd, fcntl.LOCK_UN)
+        self.store._lock.release()
+
+
+def get_session_store() -> SessionStore:
+    """ Session store chosen by the SESSION_STORE environment variable
+    (`memory`, `sqlite` or `file`)
+    """
+    store = os.getenv("SESSION_STORE", "memory")
+    if store == "memory":
+        return ShardedSessionStore(int(os.getenv("SESSION_SHARDS", "16")))
+    if store == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_SQLITE_PATH",
+                                            ".sessions.sqlite3"))
+    if store == "file":
+        return FileSessionStore(os.getenv("SESSION_FILE_PATH",
+                                          ".sessions.db"),
+                                int(os.getenv("SESSION_FILE_SLOTS",
+                                              "65536")))
+    raise ValueError("Unknown SESSION_STORE: {}".format(store))
@@ -2,17 +2,14 @@
 """Module to deal with the session authentication
 """
 
-from flask import request, jsonify, Blueprint, abort
+from flask import abort, current_app, jsonify, request
+from api.v1.views import app_views
 from models.user import User
-from api.v1.app import auth  # Import the auth object from api.v1.app
 import os
 
-# Create a Blueprint for session authentication routes
-session_auth_bp = Blueprint('session_auth', __name__,
-                            url_prefix='/auth_session')
 
-
-@session_auth_bp.route('/login', methods=['POST'])
+@app_views.route('/auth_session/login', methods=['POST'],
+                 strict_slashes=False)
 def login():
     """Handle user login for session authentication.
 
@@ -21,7 +18,7 @@ def login():
     Returns:
         JSON response with user data upon successful login.
         JSON response with error message and appropriate status code for
-        invalid login attempts.
+        invalid login attempts, or 503 when no session can be created.
     """
     # Retrieve email and password from request form data
     email = request.form.get('email')
@@ -34,7 +31,7 @@ def login():
         return jsonify({"error": "password missing"}), 400
 
     # Retrieve user based on email
-    user = User.search({'email': email})
+    user = User.first({'email': email})
     if user is None:
         return jsonify({"error": "no user found for this email"}), 404
 
@@ -42,8 +39,11 @@ def login():
     if not user.is_valid_password(password):
         return jsonify({"error": "wrong password"}), 401
 
-    # Create session ID for the user
+    # Create session ID for the user with the auth of the app
+    auth = current_app.extensions["auth"]
     session_id = auth.create_session(user.id)
+    if session_id is None:
+        return jsonify({"error": "no session available"}), 503
 
     # Return user data and set session ID as cookie
     response_data = user.to_json()
@@ -53,6 +53,9 @@ def login():
 
     return response
 
+
+@app_views.route('/auth_session/logout', methods=['DELETE'],
+                 strict_slashes=False)
 def logout():
     """Handle user logout by destroying the session.
 
@@ -61,6 +64,7 @@ def logout():
         JSON response with error message and status code 404 if logout fails.
     """
     # Destroy the session
+    auth = current_app.extensions["auth"]
     if not auth.destroy_session(request):
         abort(404)
 
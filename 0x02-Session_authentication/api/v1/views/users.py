@@ -2,7 +2,9 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request, stream_with_context
+from typing import Iterable
+import json
 from models.user import User
 
 
@@ -120,3 +122,131 @@ def update_user(user_id: str = None) -> str:
         user.last_name = rj.get('last_name')
     user.save()
     return jsonify(user.to_json()), 200
+
+
+def _batch_body() -> list:
+    """ JSON array body of a batch request, or None
+    """
+    try:
+        rj = request.get_json()
+    except Exception as e:
+        rj = None
+    if not isinstance(rj, list):
+        return None
+    return rj
+
+
+def _stream_results(results: Iterable[dict]) -> Response:
+    """ Stream per-item results as a JSON array, one item at a time
+    """
+    def generate():
+        yield "["
+        for i, result in enumerate(results):
+            yield ("," if i else "") + json.dumps(result)
+        yield "]\n"
+    return Response(stream_with_context(generate()),
+                    mimetype="application/json")
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/batch
+    JSON body:
+      - array of users (email, password, last_name and first_name)
+    Return:
+      - array of per-item results in request order: {"index", "status",
+        "user"} or {"index", "status": 400, "error"}
+      - 400 if the body isn't a JSON array
+    """
+    rj = _batch_body()
+    if rj is None:
+        return jsonify({'error': "Wrong format"}), 400
+    results = []
+    users = []
+    for i, item in enumerate(rj):
+        error_msg = None
+        if not isinstance(item, dict):
+            error_msg = "Wrong format"
+        if error_msg is None and item.get("email", "") == "":
+            error_msg = "email missing"
+        if error_msg is None and item.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is not None:
+            results.append({'index': i, 'status': 400, 'error': error_msg})
+            continue
+        user = User()
+        user.email = item.get("email")
+        user.password = item.get("password")
+        user.first_name = item.get("first_name")
+        user.last_name = item.get("last_name")
+        users.append(user)
+        results.append({'index': i, 'status': 201, 'user': user})
+    try:
+        User.bulk_save(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    return _stream_results(
+        {**r, 'user': r['user'].to_json()} if 'user' in r else r
+        for r in results)
+
+
+@app_views.route('/users/batch', methods=['PUT'], strict_slashes=False)
+def update_users() -> str:
+    """ PUT /api/v1/users/batch
+    JSON body:
+      - array of {"id", "last_name" (optional), "first_name" (optional)}
+    Return:
+      - array of per-item results in request order: {"index", "status",
+        "user"}, or {"index", "status": 404/400, "error"}
+      - 400 if the body isn't a JSON array
+    """
+    rj = _batch_body()
+    if rj is None:
+        return jsonify({'error': "Wrong format"}), 400
+    results = []
+    users = []
+    for i, item in enumerate(rj):
+        if not isinstance(item, dict) or \
+                not isinstance(item.get('id'), str):
+            results.append({'index': i, 'status': 400,
+                            'error': "Wrong format"})
+            continue
+        user = User.get(item.get('id'))
+        if user is None:
+            results.append({'index': i, 'status': 404, 'error': "Not found"})
+            continue
+        if item.get('first_name') is not None:
+            user.first_name = item.get('first_name')
+        if item.get('last_name') is not None:
+            user.last_name = item.get('last_name')
+        users.append(user)
+        results.append({'index': i, 'status': 200, 'user': user})
+    User.bulk_save(users)
+    return _stream_results(
+        {**r, 'user': r['user'].to_json()} if 'user' in r else r
+        for r in results)
+
+
+@app_views.route('/users/batch', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """ DELETE /api/v1/users/batch
+    JSON body:
+      - array of User IDs
+    Return:
+      - array of per-item results in request order: {"index", "id",
+        "status": 200} or {"index", "id", "status": 404}
+      - 400 if the body isn't a JSON array
+    """
+    rj = _batch_body()
+    if rj is None:
+        return jsonify({'error': "Wrong format"}), 400
+    ids = [user_id for user_id in rj if isinstance(user_id, str)]
+    removed = set(User.bulk_remove(ids))
+    results = []
+    for i, user_id in enumerate(rj):
+        if isinstance(user_id, str) and user_id in removed:
+            removed.discard(user_id)
+            results.append({'index': i, 'id': user_id, 'status': 200})
+        else:
+            results.append({'index': i, 'id': user_id, 'status': 404})
+    return _stream_results(results)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+""" Shared pytest fixtures
+
+Run the tests from this directory: `python -m pytest tests`
+"""
+import pytest
+
+from models import base, storage
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    """ Empty working directory for the class files, with the in-memory
+    tables and the storage engine reset before and after the test
+    """
+    monkeypatch.chdir(tmp_path)
+
+    def reset():
+        for table in (base.DATA, base.INDEXES, base.INDEXED_VALUES,
+                      base.SNAPSHOTS, base.VERSIONS, base.FLUSHED,
+                      base.NEXT_SYNC):
+            table.clear()
+        storage.set_storage(None)
+
+    reset()
+    yield tmp_path
+    base.disable_group_commit()
+    reset()
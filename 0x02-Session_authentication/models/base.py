@@ -1,40 +1,250 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from functools import lru_cache
+from os import getenv
+import atexit
+import threading
+import time
+from typing import (Callable, Dict, TypeVar, List, Iterable, Iterator,
+                    Optional, Tuple)
+from itertools import islice
+from models.commit import GroupCommitter
+from models.query import In, Predicate
+from models.storage import get_storage
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+# INDEXES[class][attribute][value] -> ids (dict used as an ordered set)
+INDEXES = {}
+# INDEXED_VALUES[class][id] -> values of INDEXED_ATTRIBUTES as last indexed
+INDEXED_VALUES = {}
+_UNHASHABLE = object()
+# Writers of a class hold LOCKS[class], also during their storage I/O.
+# Readers never take it: they scan SNAPSHOTS[class], an immutable tuple of
+# the objects that the first reader after a write rebuilds without the
+# lock, and publishes only if no write overlapped the copy.
+LOCKS = {}
+SNAPSHOTS = {}
+_LOCKS_LOCK = threading.Lock()
+# VERSIONS[class] counts writes, FLUSHED[class] is the last version
+# written by a full-file storage engine, under FLUSH_LOCKS[class].
+VERSIONS = {}
+FLUSHED = {}
+FLUSH_LOCKS = {}
+# Group commit writer, see enable_group_commit()
+COMMITTER = None
+LAZY_LOAD = getenv("MODELS_LAZY_LOAD", "0") == "1"
+# Shared storage engines are polled for the writes of other processes at
+# most every SYNC_INTERVAL seconds per class, NEXT_SYNC[class] being the
+# monotonic time of the next poll
+SYNC_INTERVAL = float(getenv("MODELS_SYNC_MS", "1000")) / 1000
+NEXT_SYNC = {}
+# LISTENERS[event] is a tuple of (class, callback), replaced on every
+# (un)registration so dispatching needs no lock
+LISTENERS = {"save": (), "remove": (), "load": ()}
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string
+
+    datetime.fromisoformat is much cheaper than strptime and gives the
+    same result once the string has the exact YYYY-MM-DDTHH:MM:SS shape.
+    """
+    if len(value) == 19 and value[10] == 'T' and value[13] == ':' \
+            and value[16] == ':':
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+@lru_cache(maxsize=4096)
+def format_epoch(seconds: int) -> str:
+    """ Format seconds since the epoch with TIMESTAMP_FORMAT
+    """
+    return '%04d-%02d-%02dT%02d:%02d:%02d' % time.gmtime(seconds)[:6]
+
+
+class LazyTable(MutableMapping):
+    """ DATA table keeping loaded records in serialized form until an
+    object is actually read, then replacing it with the model instance
+
+    Records sharing the same keys (the usual case) are kept as a tuple of
+    values, the key order being stored once for the whole table.
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize an empty table for a model class
+        """
+        self._cls = cls
+        self._keys = None
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def add_raw(self, obj_id: str, obj_json: dict):
+        """ Store a serialized record without building the object
+        """
+        if obj_json.get('id') == obj_id:
+            # share the key string instead of keeping a second copy
+            obj_json['id'] = obj_id
+        keys = tuple(obj_json)
+        if self._keys is None:
+            self._keys = keys
+        if keys == self._keys:
+            self._items[obj_id] = tuple(obj_json.values())
+        else:
+            self._items[obj_id] = obj_json
+
+    def _raw(self, obj) -> dict:
+        """ Serialized dict of a stored record, None if materialized
+        """
+        if type(obj) is tuple:
+            return dict(zip(self._keys, obj))
+        if type(obj) is dict:
+            return obj
+        return None
+
+    def copy(self) -> 'LazyTable':
+        """ Shallow copy sharing the stored records
+        """
+        table = LazyTable(self._cls)
+        table._keys = self._keys
+        table._items = self._items.copy()
+        return table
+
+    def serialized_items(self) -> Iterator[Tuple[str, dict]]:
+        """ (id, to_json(True)) pairs, reusing raw records as they are
+        """
+        for obj_id, obj in self._items.items():
+            raw = self._raw(obj)
+            yield obj_id, obj.to_json(True) if raw is None else raw
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return the object, materializing it on first access
+        """
+        obj = self._items[obj_id]
+        if self._raw(obj) is not None:
+            with self._lock:
+                obj = self._items[obj_id]
+                raw = self._raw(obj)
+                if raw is not None:
+                    obj = self._cls(**raw)
+                    self._items[obj_id] = obj
+        return obj
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Store an object
+        """
+        self._items[obj_id] = obj
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object
+        """
+        del self._items[obj_id]
+
+    def __contains__(self, obj_id: str) -> bool:
+        """ True if the id is in the table
+        """
+        return obj_id in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over ids
+        """
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        """ Number of objects, materialized or not
+        """
+        return len(self._items)
 
 
 class Base():
     """ Base class
+
+    Models are __slots__ based: subclasses list their attributes in
+    __slots__, and created_at/updated_at are kept as integer microseconds
+    since the epoch behind datetime properties. Attributes of a subclass
+    that does not declare __slots__ live in its __dict__ and are
+    serialized as well.
+
+    Subclasses list in INDEXED_ATTRIBUTES the attributes `search` can look
+    up through a hash index instead of scanning every object. Indexes
+    reflect objects as they were last saved or loaded.
     """
 
+    __slots__ = ('id', '_created_at', '_updated_at', '__weakref__')
+    INDEXED_ATTRIBUTES: Tuple[str, ...] = ()
+    # slot -> key in to_json, for slots hidden behind a property
+    JSON_KEYS = {'_created_at': 'created_at', '_updated_at': 'updated_at'}
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+        if INDEXES.get(s_class) is None:
+            self.__class__._reset_indexes()
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
+    @staticmethod
+    def _to_epoch(value):
+        """ Naive datetime -> microseconds since the epoch, other values
+        are stored as they are
+        """
+        if type(value) is datetime and value.tzinfo is None:
+            return (value - EPOCH) // ONE_MICROSECOND
+        return value
+
+    @staticmethod
+    def _from_epoch(value):
+        """ Microseconds since the epoch -> naive datetime
+        """
+        if type(value) is int:
+            return EPOCH + timedelta(microseconds=value)
+        return value
+
+    @property
+    def created_at(self) -> datetime:
+        """ Creation date
+        """
+        return self._from_epoch(self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Set the creation date
+        """
+        self._created_at = self._to_epoch(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update date
+        """
+        return self._from_epoch(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Set the last update date
+        """
+        self._updated_at = self._to_epoch(value)
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -44,11 +254,40 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def _json_fields(cls) -> Tuple[Tuple[str, str, bool], ...]:
+        """ (slot, to_json key, is a timestamp) of the class in
+        declaration order, computed once per class
+        """
+        fields = cls.__dict__.get('_JSON_FIELDS')
+        if fields is None:
+            fields = tuple(
+                (slot, cls.JSON_KEYS.get(slot, slot), slot in cls.JSON_KEYS)
+                for klass in reversed(cls.__mro__)
+                for slot in klass.__dict__.get('__slots__', ())
+                if slot != '__weakref__')
+            cls._JSON_FIELDS = fields
+        return fields
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for slot, key, timestamp in self._json_fields():
+            if not for_serialization and key[0] == '_':
+                continue
+            try:
+                value = getattr(self, slot)
+            except AttributeError:
+                continue
+            if timestamp and type(value) is int:
+                result[key] = format_epoch(value // 1000000)
+            elif type(value) is datetime:
+                result[key] = value.strftime(TIMESTAMP_FORMAT)
+            else:
+                result[key] = value
+        # Attributes of subclasses that do not declare __slots__
+        for key, value in getattr(self, '__dict__', {}).items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -58,53 +297,436 @@ class Base():
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def _reset_indexes(cls):
+        """ Drop and recreate the (empty) indexes of the class
+        """
+        s_class = cls.__name__
+        INDEXES[s_class] = {attr: {} for attr in cls.INDEXED_ATTRIBUTES}
+        INDEXED_VALUES[s_class] = {}
+
+    @classmethod
+    def _index_add(cls, obj: TypeVar('Base'), raw: dict = None):
+        """ Index an object, replacing its previous entries
+
+        `raw` indexes a serialized record (as stored by LazyTable)
+        instead, with `obj` being its id.
+        """
+        s_class = cls.__name__
+        indexes = INDEXES[s_class]
+        if not indexes:
+            return
+        obj_id = obj if raw is not None else obj.id
+        old_values = INDEXED_VALUES[s_class].get(obj_id)
+        values = []
+        for i, (attr, index) in enumerate(indexes.items()):
+            if raw is not None:
+                value = raw.get(attr)
+            else:
+                value = getattr(obj, attr, None)
+            try:
+                hash(value)
+            except TypeError:
+                value = _UNHASHABLE
+            values.append(value)
+            if old_values is not None:
+                if old_values[i] is value or old_values[i] == value:
+                    continue
+                cls._index_discard(index, old_values[i], obj_id)
+            index.setdefault(value, {})[obj_id] = None
+        INDEXED_VALUES[s_class][obj_id] = tuple(values)
+
+    @classmethod
+    def _index_remove(cls, obj_id: str):
+        """ Remove an object from the indexes
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        old_values = INDEXED_VALUES[s_class].pop(obj_id, None)
+        if old_values is None:
             return
+        for index, value in zip(INDEXES[s_class].values(), old_values):
+            cls._index_discard(index, value, obj_id)
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @staticmethod
+    def _index_discard(index: dict, value, obj_id: str):
+        """ Remove one id from an index bucket
+        """
+        bucket = index.get(value)
+        if bucket is not None:
+            bucket.pop(obj_id, None)
+            if not bucket:
+                del index[value]
 
     @classmethod
-    def save_to_file(cls):
-        """ Save all objects to file
+    def _lock(cls) -> threading.RLock:
+        """ Writer lock of the class
+        """
+        s_class = cls.__name__
+        lock = LOCKS.get(s_class)
+        if lock is None:
+            with _LOCKS_LOCK:
+                lock = LOCKS.setdefault(s_class, threading.RLock())
+                FLUSH_LOCKS.setdefault(s_class, threading.Lock())
+        return lock
+
+    @classmethod
+    def _changed(cls) -> int:
+        """ Record a write (writer lock held) and return its version
+        """
+        s_class = cls.__name__
+        # Bump the version before dropping the snapshot: a reader that
+        # published a copy missing this write then sees the new version
+        VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+        SNAPSHOTS.pop(s_class, None)
+        return VERSIONS[s_class]
+
+    @classmethod
+    def generation(cls) -> int:
+        """ Number increased by every change of the class (save, remove,
+        load): a cache built at a generation is valid while it is the
+        same
+        """
+        return VERSIONS.get(cls.__name__, 0)
+
+    @classmethod
+    def _listen(cls, event: str, callback: Callable) -> Callable:
+        """ Register `callback(cls, id, version)` for `event` on the class
+        and its subclasses
+        """
+        with _LOCKS_LOCK:
+            LISTENERS[event] = LISTENERS[event] + ((cls, callback),)
+        return callback
+
+    @classmethod
+    def on_save(cls, callback: Callable) -> Callable:
+        """ Call `callback(cls, id, version)` after an object of the class
+        is saved (can be used as a decorator)
+        """
+        return cls._listen("save", callback)
+
+    @classmethod
+    def on_remove(cls, callback: Callable) -> Callable:
+        """ Call `callback(cls, id, version)` after an object of the class
+        is removed (can be used as a decorator)
+        """
+        return cls._listen("remove", callback)
+
+    @classmethod
+    def on_load(cls, callback: Callable) -> Callable:
+        """ Call `callback(cls, None, version)` after all objects of the
+        class are (re)loaded (can be used as a decorator)
+        """
+        return cls._listen("load", callback)
+
+    @staticmethod
+    def off(callback: Callable):
+        """ Unregister a callback from all events
+        """
+        with _LOCKS_LOCK:
+            for event, listeners in LISTENERS.items():
+                LISTENERS[event] = tuple(
+                    (target, fn) for target, fn in listeners
+                    if fn is not callback)
+
+    @classmethod
+    def _notify(cls, event: str, obj_id: Optional[str], version: int):
+        """ Call the listeners of an event, once the writer lock is
+        released; exceptions they raise reach the writer, after the write
+        is persisted
+        """
+        for target, callback in LISTENERS[event]:
+            if issubclass(cls, target):
+                callback(cls, obj_id, version)
+
+    @classmethod
+    def _snapshot(cls) -> Tuple[TypeVar('Base'), ...]:
+        """ Immutable view of all objects, safe to iterate while other
+        threads write, built without waiting for the writers
+        """
+        s_class = cls.__name__
+        snapshot = SNAPSHOTS.get(s_class)
+        while snapshot is None:
+            version = VERSIONS.get(s_class, 0)
+            try:
+                snapshot = tuple(DATA[s_class].values())
+            except (RuntimeError, KeyError):
+                # A write resized the table during the copy: copy again
+                continue
+            SNAPSHOTS[s_class] = snapshot
+            if VERSIONS.get(s_class, 0) != version:
+                # A write overlapped the copy: use it for this read only
+                SNAPSHOTS.pop(s_class, None)
+        return snapshot
+
+    @classmethod
+    def _flush(cls, version: int = None):
+        """ Write the whole class file unless a flush that started after
+        `version` already did (always when `version` is None)
+
+        Writers keep going while a flush runs on a copy of the table, and
+        every write made meanwhile is covered by the next single flush.
+        """
+        s_class = cls.__name__
+        cls._lock()
+        with FLUSH_LOCKS[s_class]:
+            if version is not None and FLUSHED.get(s_class, 0) >= version:
+                return
+            with cls._lock():
+                table = DATA[s_class].copy()
+                current = VERSIONS.get(s_class, 0)
+            get_storage().save_all(s_class, table)
+            FLUSHED[s_class] = current
+
+    @classmethod
+    def _apply_changes(cls, changes: dict):
+        """ Persist a group commit batch of the class
+        """
+        storage = get_storage()
+        if storage.full_rewrite:
+            cls._flush()
+            return
+        with cls._lock():
+            storage.apply(cls.__name__, changes, DATA[cls.__name__])
+
+    @classmethod
+    def _sync(cls):
+        """ Apply the writes other processes made through a shared
+        storage engine, polled at most every SYNC_INTERVAL
+        """
+        storage = get_storage()
+        if not storage.shared:
+            return
+        s_class = cls.__name__
+        now = time.monotonic()
+        if now < NEXT_SYNC.get(s_class, 0) or s_class not in DATA:
+            return
+        NEXT_SYNC[s_class] = now + SYNC_INTERVAL
+        events = []
+        with cls._lock():
+            changes = storage.changes_since(s_class)
+            if changes:
+                table = DATA[s_class]
+                lazy = isinstance(table, LazyTable)
+                for obj_id, obj_json in changes:
+                    if obj_json is None:
+                        if obj_id not in table:
+                            continue
+                        del table[obj_id]
+                        cls._index_remove(obj_id)
+                        events.append(("remove", obj_id))
+                        continue
+                    if lazy:
+                        table.add_raw(obj_id, obj_json)
+                        cls._index_add(obj_id, obj_json)
+                    else:
+                        obj = cls(**obj_json)
+                        table[obj_id] = obj
+                        cls._index_add(obj)
+                    events.append(("save", obj_id))
+                version = cls._changed()
+        if changes is None:
+            cls.load_from_file()
+        for event, obj_id in events:
+            cls._notify(event, obj_id, version)
+
+    @classmethod
+    def load_from_file(cls, lazy: bool = None):
+        """ Load all objects from file
+
+        With `lazy` (MODELS_LAZY_LOAD=1 by default) records stay in their
+        serialized form until get/search/all reach them.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        if COMMITTER is not None:
+            COMMITTER.drain()
+        with cls._lock():
+            cls._reset_indexes()
+            if LAZY_LOAD if lazy is None else lazy:
+                table = LazyTable(cls)
+                for obj_id, obj_json in get_storage().load(s_class):
+                    table.add_raw(obj_id, obj_json)
+                    cls._index_add(obj_id, obj_json)
+            else:
+                table = {}
+                for obj_id, obj_json in get_storage().load(s_class):
+                    obj = cls(**obj_json)
+                    table[obj_id] = obj
+                    cls._index_add(obj)
+            DATA[s_class] = table
+            version = FLUSHED[s_class] = cls._changed()
+        cls._notify("load", None, version)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def save_to_file(cls):
+        """ Save all objects to file
+        """
+        if COMMITTER is not None:
+            COMMITTER.drain()
+        cls._flush(None)
 
-    def save(self):
+    def save(self, wait: bool = False):
         """ Save current object
+
+        With group commit enabled the write is queued; `wait` blocks
+        until it is durable.
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        cls = self.__class__
+        s_class = cls.__name__
+        storage = get_storage()
+        committer = COMMITTER
+        with cls._lock():
+            self.updated_at = datetime.utcnow()
+            DATA[s_class][self.id] = self
+            cls._index_add(self)
+            version = cls._changed()
+            if committer is not None:
+                ticket = committer.submit(cls, self.id, self)
+            elif not storage.full_rewrite:
+                storage.upsert(s_class, self, DATA[s_class])
+        try:
+            cls._notify("save", self.id, version)
+        finally:
+            if committer is not None:
+                if wait:
+                    committer.wait(ticket)
+            elif storage.full_rewrite:
+                cls._flush(version)
 
-    def remove(self):
+    def remove(self, wait: bool = False):
         """ Remove object
+
+        With group commit enabled the write is queued; `wait` blocks
+        until it is durable.
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
+        cls = self.__class__
+        s_class = cls.__name__
+        storage = get_storage()
+        committer = COMMITTER
+        with cls._lock():
+            if DATA[s_class].get(self.id) is None:
+                return
             del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+            cls._index_remove(self.id)
+            version = cls._changed()
+            if committer is not None:
+                ticket = committer.submit(cls, self.id, None)
+            elif not storage.full_rewrite:
+                storage.delete(s_class, self.id, DATA[s_class])
+        try:
+            cls._notify("remove", self.id, version)
+        finally:
+            if committer is not None:
+                if wait:
+                    committer.wait(ticket)
+            elif storage.full_rewrite:
+                cls._flush(version)
+
+    @classmethod
+    def _bulk_write(cls, changes: Dict[str, Optional[TypeVar('Base')]],
+                    wait: bool = False) -> List[str]:
+        """ Apply many changes (each id maps to the object to save, or to
+        None to remove it) to the table and indexes, then persist them
+        all at once. Removals of unknown ids are ignored.
+
+        Return the ids actually changed.
+        """
+        s_class = cls.__name__
+        storage = get_storage()
+        committer = COMMITTER
+        with cls._lock():
+            table = DATA[s_class]
+            applied = {}
+            for obj_id, obj in changes.items():
+                if obj is not None:
+                    table[obj_id] = obj
+                    cls._index_add(obj)
+                elif obj_id in table:
+                    del table[obj_id]
+                    cls._index_remove(obj_id)
+                else:
+                    continue
+                applied[obj_id] = obj
+            if not applied:
+                return []
+            version = cls._changed()
+            if committer is not None:
+                for obj_id, obj in applied.items():
+                    ticket = committer.submit(cls, obj_id, obj)
+            elif not storage.full_rewrite:
+                storage.apply(s_class, applied, table)
+        try:
+            for obj_id, obj in applied.items():
+                cls._notify("save" if obj is not None else "remove", obj_id,
+                            version)
+        finally:
+            if committer is not None:
+                if wait:
+                    committer.wait(ticket)
+            elif storage.full_rewrite:
+                cls._flush(version)
+        return list(applied)
+
+    @classmethod
+    def bulk_save(cls, objs: Iterable[TypeVar('Base')],
+                  wait: bool = False) -> List[TypeVar('Base')]:
+        """ Save many objects of the class with a single write
+        """
+        objs = list(objs)
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+        cls._bulk_write({obj.id: obj for obj in objs}, wait)
+        return objs
+
+    @classmethod
+    def bulk_remove(cls, ids: Iterable[str],
+                    wait: bool = False) -> List[str]:
+        """ Remove many objects by ID with a single write and return the
+        IDs that existed
+        """
+        return cls._bulk_write(dict.fromkeys(ids), wait)
+
+    @classmethod
+    def bulk_update(cls, ids: Iterable[str], wait: bool = False,
+                    **fields: dict) -> List[TypeVar('Base')]:
+        """ Set the same attributes on many objects by ID with a single
+        write and return the updated objects (unknown IDs are skipped)
+
+        Raise AttributeError, before changing any object, if a field
+        cannot be set on the class.
+        """
+        s_class = cls.__name__
+        for k in fields:
+            if not cls._settable(k):
+                raise AttributeError("'{}' object has no settable attribute "
+                                     "'{}'".format(s_class, k))
+        objs = []
+        for obj_id in ids:
+            obj = DATA[s_class].get(obj_id)
+            if obj is None:
+                continue
+            for k, v in fields.items():
+                setattr(obj, k, v)
+            objs.append(obj)
+        return cls.bulk_save(objs, wait)
+
+    @classmethod
+    def _settable(cls, name: str) -> bool:
+        """ Whether setattr can set `name` on objects of the class: a slot,
+        a property with a setter, or any attribute when objects have a
+        __dict__
+        """
+        descriptor = getattr(cls, name, None)
+        if isinstance(descriptor, property):
+            return descriptor.fset is not None
+        if hasattr(descriptor, '__set__'):
+            return True
+        return cls.__dictoffset__ != 0
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        cls._sync()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -118,21 +740,140 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        cls._sync()
         s_class = cls.__name__
         return DATA[s_class].get(id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def search(cls, attributes: dict = {}, limit: int = None,
+               offset: int = 0, order_by: str = None
+               ) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Attribute values are compared for equality, or can be a
+        models.query predicate (Prefix, Range, In). `order_by` is an
+        attribute name, prefixed by "-" for descending order.
         """
-        s_class = cls.__name__
+        return list(cls.iter_search(attributes, limit, offset, order_by))
+
+    @classmethod
+    def iter_search(cls, attributes: dict = {}, limit: int = None,
+                    offset: int = 0, order_by: str = None
+                    ) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield objects with matching attributes
 
+        Without `order_by` the scan stops as soon as `limit` objects
+        have been found.
+        """
         def _search(obj):
             if len(attributes) == 0:
                 return True
             for k, v in attributes.items():
-                if (getattr(obj, k) != v):
+                if isinstance(v, Predicate):
+                    if not v.matches(getattr(obj, k)):
+                        return False
+                elif (getattr(obj, k) != v):
                     return False
             return True
 
-        return list(filter(_search, DATA[s_class].values()))
+        cls._sync()
+        matches = filter(_search, cls._candidates(attributes))
+        if order_by is not None:
+            reverse = order_by.startswith('-')
+            key = order_by.lstrip('-')
+
+            def _key(obj):
+                value = getattr(obj, key)
+                return (value is not None, value)
+
+            matches = iter(sorted(matches, key=_key, reverse=reverse))
+        stop = None if limit is None else offset + limit
+        return islice(matches, offset, stop)
+
+    @classmethod
+    def first(cls, attributes: dict = {},
+              order_by: str = None) -> TypeVar('Base'):
+        """ Return the first object with matching attributes, or None
+        """
+        return next(cls.iter_search(attributes, 1, 0, order_by), None)
+
+    @classmethod
+    def exists(cls, attributes: dict = {}) -> bool:
+        """ True if at least one object has matching attributes
+        """
+        return cls.first(attributes) is not None
+
+    @classmethod
+    def _candidates(cls, attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Objects that may match `attributes`
+
+        Equality and In constraints on indexed attributes are looked up
+        in the index and the smallest result is used; other constraints
+        are checked afterwards. Without any usable index, all objects.
+        """
+        s_class = cls.__name__
+        indexes = INDEXES.get(s_class, {})
+        best = None
+        for k, v in attributes.items():
+            if k not in indexes:
+                continue
+            if isinstance(v, In):
+                values = v.values
+            elif isinstance(v, Predicate):
+                continue
+            else:
+                values = [v]
+            try:
+                bucket = {}
+                for value in values:
+                    bucket.update(indexes[k].get(value, ()))
+            except TypeError:
+                continue
+            unhashable = indexes[k].get(_UNHASHABLE)
+            if unhashable:
+                bucket.update(unhashable)
+            if best is None or len(bucket) < len(best):
+                best = bucket
+        if best is None:
+            return cls._snapshot()
+        table = DATA[s_class]
+        objs = (table.get(obj_id) for obj_id in tuple(best))
+        return [obj for obj in objs if obj is not None]
+
+
+def _apply_batch(cls: type, changes: dict):
+    """ GroupCommitter callback
+    """
+    cls._apply_changes(changes)
+
+
+def enable_group_commit(interval_ms: float = 10.0,
+                        max_batch: int = 100) -> GroupCommitter:
+    """ Queue saves/removes and persist them in shared batches written
+    every `interval_ms` or once `max_batch` changes are pending
+    """
+    global COMMITTER
+    if COMMITTER is None:
+        COMMITTER = GroupCommitter(_apply_batch, interval_ms, max_batch)
+        atexit.register(disable_group_commit)
+    return COMMITTER
+
+
+def disable_group_commit():
+    """ Write pending changes and go back to synchronous writes
+    """
+    global COMMITTER
+    committer, COMMITTER = COMMITTER, None
+    if committer is not None:
+        committer.stop()
+
+
+def group_commit_stats() -> dict:
+    """ Flush latency and batch size metrics of the group commit writer
+    """
+    return COMMITTER.stats() if COMMITTER is not None else {}
+
+
+if getenv("MODELS_GROUP_COMMIT_MS"):
+    enable_group_commit(float(getenv("MODELS_GROUP_COMMIT_MS")),
+                        int(getenv("MODELS_GROUP_COMMIT_BATCH", "100")))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+""" Group commit module
+"""
+from collections import deque
+from typing import Callable, Dict, Optional, TypeVar
+import logging
+import threading
+import time
+
+
+class GroupCommitter():
+    """ Background writer batching the changes of many saves/removes
+
+    Changes are queued per class, keyed by id (the latest state wins), and
+    written by one thread every `interval_ms` or as soon as `max_batch`
+    changes are pending. `submit` returns a ticket that `wait` blocks on
+    until the change is durable. A batch whose write raised is counted in
+    `errors` and logged, and its exception is raised again by `wait` for
+    every ticket of the batch (and by the next `drain`): a failed change
+    is never reported durable.
+    """
+
+    def __init__(self, apply: Callable[[type, Dict[str, Optional[
+                 TypeVar('Base')]]], None],
+                 interval_ms: float = 10.0, max_batch: int = 100):
+        """ Start the writer thread
+
+        `apply(cls, changes)` persists a batch where each id maps to the
+        object to upsert or to None for a removal.
+        """
+        self.apply = apply
+        self.interval = interval_ms / 1000.0
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._count = 0
+        self._submitted = 0
+        self._durable = 0
+        self._taken = 0
+        self._drained = 0
+        # (first ticket, last ticket, exception) of the last failed batches
+        self._failures = deque(maxlen=64)
+        self._stopped = False
+        self.flushes = 0
+        self.flushed_changes = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="group-commit")
+        self._thread.start()
+
+    def submit(self, cls: type, obj_id: str,
+               obj: Optional[TypeVar('Base')]) -> int:
+        """ Queue an upsert (or a removal when obj is None) and return
+        its ticket
+        """
+        with self._cond:
+            changes = self._pending.setdefault(cls, {})
+            changes.pop(obj_id, None)
+            changes[obj_id] = obj
+            self._count += 1
+            self._submitted += 1
+            # wake the writer to open a batch, or to close a full one
+            if self._count == 1 or self._count >= self.max_batch:
+                self._cond.notify_all()
+            return self._submitted
+
+    def wait(self, ticket: int, timeout: float = None) -> bool:
+        """ Block until the change of `ticket` is durable, False on
+        timeout; raise the exception of its batch if the write failed
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._durable >= ticket,
+                                       timeout):
+                return False
+            for first, last, error in self._failures:
+                if first <= ticket <= last:
+                    raise error
+            return True
+
+    def drain(self, timeout: float = None) -> bool:
+        """ Block until every change submitted so far is durable, False
+        on timeout; raise the exception of a batch that failed since the
+        previous drain
+        """
+        with self._cond:
+            ticket = self._submitted
+            if not self._cond.wait_for(lambda: self._durable >= ticket,
+                                       timeout):
+                return False
+            drained, self._drained = self._drained, max(self._drained,
+                                                        ticket)
+            for first, last, error in self._failures:
+                if last > drained and first <= ticket:
+                    raise error
+            return True
+
+    def stop(self):
+        """ Write what is pending and stop the writer thread
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        """ Flush counters: number of flushes, batch sizes and latencies
+        """
+        with self._cond:
+            return {
+                "pending": self._count,
+                "flushes": self.flushes,
+                "flushed_changes": self.flushed_changes,
+                "last_batch_size": self.last_batch_size,
+                "avg_batch_size": (self.flushed_changes / self.flushes
+                                   if self.flushes else 0.0),
+                "last_flush_ms": self.last_flush_ms,
+                "max_flush_ms": self.max_flush_ms,
+                "avg_flush_ms": (self.total_flush_ms / self.flushes
+                                 if self.flushes else 0.0),
+                "errors": self.errors,
+            }
+
+    def _run(self):
+        """ Writer loop
+        """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._count or self._stopped)
+                if not self._count:
+                    return
+                # let the batch fill up until the interval elapses or
+                # max_batch is reached
+                deadline = time.monotonic() + self.interval
+                while self._count < self.max_batch and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        break
+                batch, self._pending = self._pending, {}
+                size, self._count = self._count, 0
+                first, ticket = self._taken + 1, self._submitted
+                self._taken = ticket
+            start = time.perf_counter()
+            error = None
+            for cls, changes in batch.items():
+                try:
+                    self.apply(cls, changes)
+                except Exception as e:
+                    logging.getLogger(__name__).exception(
+                        "group commit of %d %s changes failed",
+                        len(changes), cls.__name__)
+                    error = e
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._cond:
+                if error is not None:
+                    self.errors += 1
+                    self._failures.append((first, ticket, error))
+                self.flushes += 1
+                self.flushed_changes += size
+                self.last_batch_size = size
+                self.last_flush_ms = elapsed
+                self.max_flush_ms = max(self.max_flush_ms, elapsed)
+                self.total_flush_ms += elapsed
+                self._durable = ticket
+                self._cond.notify_all()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+""" Query predicates module
+
+Predicates can be used as values in `Base.search` attributes, e.g.
+`User.search({"email": Prefix("bob")})`. Plain values keep meaning
+equality.
+"""
+from typing import Any, Iterable
+
+
+class Predicate():
+    """ Base class of search predicates
+    """
+
+    def matches(self, value: Any) -> bool:
+        """ True if an attribute value satisfies the predicate
+        """
+        raise NotImplementedError()
+
+
+class Prefix(Predicate):
+    """ String attribute starting with a prefix
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize a Prefix predicate
+        """
+        self.prefix = prefix
+
+    def matches(self, value: Any) -> bool:
+        """ True if value is a string starting with the prefix
+        """
+        return isinstance(value, str) and value.startswith(self.prefix)
+
+
+class Range(Predicate):
+    """ Attribute within bounds; `low` is inclusive, `high` exclusive
+    unless `inclusive=True`. A None bound is open.
+    """
+
+    def __init__(self, low: Any = None, high: Any = None,
+                 inclusive: bool = False):
+        """ Initialize a Range predicate
+        """
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+
+    def matches(self, value: Any) -> bool:
+        """ True if value lies in the range
+        """
+        if value is None:
+            return False
+        try:
+            if self.low is not None and value < self.low:
+                return False
+            if self.high is not None:
+                if self.inclusive:
+                    return value <= self.high
+                return value < self.high
+        except TypeError:
+            return False
+        return True
+
+
+class In(Predicate):
+    """ Attribute equal to one of several values
+    """
+
+    def __init__(self, values: Iterable[Any]):
+        """ Initialize an In predicate
+        """
+        self.values = list(values)
+
+    def matches(self, value: Any) -> bool:
+        """ True if value equals one of the values
+        """
+        return any(value == v for v in self.values)
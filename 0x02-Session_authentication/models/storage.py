@@ -0,0 +1,675 @@
+#!/usr/bin/env python3
+""" Storage engines module
+"""
+from os import getenv, path
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Tuple,
+                    TypeVar)
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> str:
+    """ Serialize to a JSON string, with orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def loads(data: str) -> Any:
+    """ Parse a JSON string, with orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json_object(file_path: str, items: Iterable[Tuple[str, Any]],
+                      fsync: bool = False):
+    """ Write (key, value) pairs as one JSON object, one record at a
+    time, to a temp file renamed over `file_path` once complete
+
+    The file is formatted exactly like json.dump would write the whole
+    object, so records are encoded with the json module even when orjson
+    (which has no separator options) is installed.
+    """
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write("{")
+        separator = ""
+        for key, value in items:
+            f.write(separator + json.dumps(key) + ": " + json.dumps(value))
+            separator = ", "
+        f.write("}")
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def iter_json_object(file_path: str, chunk_size: int = 1 << 16
+                     ) -> Iterator[Tuple[str, Any]]:
+    """ Incrementally parse a file holding one JSON object and yield its
+    (key, value) pairs, reading `chunk_size` characters at a time
+
+    Values are decoded by the C scanner of the json module: decoding
+    each record with orjson instead was measured slower, the cost being
+    in the framing around the records.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r') as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def _fill() -> bool:
+            """ Append the next chunk to the buffer, False at EOF
+            """
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buf = buf[pos:] + chunk
+            pos = 0
+            return True
+
+        def _skip_ws():
+            """ Move past whitespace, reading more input as needed
+            """
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\n\r":
+                    pos += 1
+                if pos < len(buf) or not _fill():
+                    return
+
+        def _expect(chars: str) -> str:
+            """ Consume one of `chars` after optional whitespace
+            """
+            nonlocal pos
+            _skip_ws()
+            if pos >= len(buf) or buf[pos] not in chars:
+                raise json.JSONDecodeError(
+                    "Expecting one of {!r}".format(chars), buf, pos)
+            pos += 1
+            return buf[pos - 1]
+
+        def _value() -> Any:
+            """ Decode the next JSON value, reading more input until it
+            is complete
+            """
+            nonlocal pos
+            _skip_ws()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof or not _fill():
+                        raise
+                    continue
+                # a number is only complete once followed by a delimiter,
+                # it may go on in the next chunk ("1" then ".5")
+                if isinstance(value, (int, float)) and not eof and \
+                        (end == len(buf) or buf[end] not in " \t\n\r,}]") \
+                        and _fill():
+                    continue
+                pos = end
+                return value
+
+        _expect("{")
+        _skip_ws()
+        if pos < len(buf) and buf[pos] == "}":
+            return
+        while True:
+            key = _value()
+            _expect(":")
+            yield key, _value()
+            if _expect(",}") == "}":
+                return
+
+
+def serialized_items(table: Dict[str, TypeVar('Base')]
+                     ) -> Iterator[Tuple[str, dict]]:
+    """ (id, to_json(True)) pairs of a table, without materializing the
+    records a lazily loaded table still holds in serialized form
+    """
+    if hasattr(table, "serialized_items"):
+        return table.serialized_items()
+    return ((obj_id, obj.to_json(True)) for obj_id, obj in table.items())
+
+
+class Storage():
+    """ Storage engine interface used by models.base.Base
+
+    A table is the `DATA[class_name]` dict mapping ids to model objects.
+    Engines with `full_rewrite` set persist a class by rewriting all of
+    it; Base then calls save_all instead of upsert/delete so concurrent
+    writes can share one rewrite. Engines with `shared` set can be used
+    by several processes at once, which poll `changes_since` to see the
+    writes of the others.
+    """
+
+    full_rewrite = False
+    shared = False
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, dict]]:
+        """ Iterate over (id, serialized object) pairs of a class
+        """
+        raise NotImplementedError()
+
+    def save_all(self, s_class: str, table: Dict[str, TypeVar('Base')]):
+        """ Persist every object of a class, replacing what is stored
+        """
+        raise NotImplementedError()
+
+    def upsert(self, s_class: str, obj: TypeVar('Base'),
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist one created or updated object
+        """
+        raise NotImplementedError()
+
+    def delete(self, s_class: str, obj_id: str,
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist the removal of one object
+        """
+        raise NotImplementedError()
+
+    def apply(self, s_class: str, changes: Dict[str, TypeVar('Base')],
+              table: Dict[str, TypeVar('Base')]):
+        """ Persist a batch of changes: each id maps to the object to
+        upsert, or to None when it was removed
+        """
+        for obj_id, obj in changes.items():
+            if obj is None:
+                self.delete(s_class, obj_id, table)
+            else:
+                self.upsert(s_class, obj, table)
+
+    def changes_since(self, s_class: str
+                      ) -> Optional[List[Tuple[str, Optional[dict]]]]:
+        """ Changes of a class written by other processes since the last
+        load or call: (id, serialized object, or None if removed) pairs,
+        or None when the whole class must be reloaded. Engines that are
+        not `shared` never see any.
+        """
+        return []
+
+
+class JSONFileStorage(Storage):
+    """ One `.db_<Class>.json` file per class, rewritten on every write
+    """
+
+    full_rewrite = True
+
+    def file_path(self, s_class: str) -> str:
+        """ Path of the JSON file of a class
+        """
+        return ".db_{}.json".format(s_class)
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, dict]]:
+        """ Iterate over (id, serialized object) pairs of a class
+        """
+        file_path = self.file_path(s_class)
+        if not path.exists(file_path):
+            return iter(())
+        return iter_json_object(file_path)
+
+    def save_all(self, s_class: str, table: Dict[str, TypeVar('Base')]):
+        """ Persist every object of a class, replacing what is stored
+        """
+        write_json_object(self.file_path(s_class), serialized_items(table),
+                          fsync=True)
+
+    def upsert(self, s_class: str, obj: TypeVar('Base'),
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist one created or updated object
+        """
+        self.save_all(s_class, table)
+
+    def delete(self, s_class: str, obj_id: str,
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist the removal of one object
+        """
+        self.save_all(s_class, table)
+
+    def apply(self, s_class: str, changes: Dict[str, TypeVar('Base')],
+              table: Dict[str, TypeVar('Base')]):
+        """ Persist a batch of changes with a single rewrite
+        """
+        self.save_all(s_class, table)
+
+
+class SQLiteStorage(Storage):
+    """ Embedded SQLite database with one row per object, shareable by
+    several processes (e.g. gunicorn workers)
+
+    The database runs in WAL mode so readers never block the writer.
+    Every write also appends the ids it touched to a `changes` log,
+    tagged with the pid of the writing process; `changes_since` lets
+    the other processes pick them up. Only the last `keep_changes` log
+    entries are kept; a process that fell further behind reloads the
+    whole class.
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str = ".db.sqlite3",
+                 keep_changes: int = 10000):
+        """ Open (and create if needed) the database
+        """
+        self.db_path = db_path
+        self.keep_changes = keep_changes
+        self._seen = {}
+        self._pid = None
+        self._db()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "class TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (class, id))")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS changes ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "class TEXT NOT NULL, id TEXT, origin INTEGER NOT NULL)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS changes_class "
+                "ON changes (class, seq)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _db(self) -> sqlite3.Connection:
+        """ Connection of the current process, reopened after a fork
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._lock = threading.Lock()
+            self._conn = sqlite3.connect(self.db_path,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._logged = 0
+        return self._conn
+
+    def _log(self, s_class: str, ids: Iterable[str]):
+        """ Record written ids (None for the whole class) in the change
+        log (transaction open) and prune it now and then
+        """
+        rows = [(s_class, obj_id, self._pid) for obj_id in ids]
+        self._conn.executemany(
+            "INSERT INTO changes (class, id, origin) VALUES (?, ?, ?)", rows)
+        self._logged += len(rows)
+        if self._logged >= self.keep_changes // 10:
+            self._logged = 0
+            cutoff = self._conn.execute(
+                "SELECT MAX(seq) FROM changes").fetchone()[0] \
+                - self.keep_changes
+            if cutoff > 0:
+                self._conn.execute("DELETE FROM changes WHERE seq <= ?",
+                                   (cutoff,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) "
+                    "VALUES ('pruned', ?)", (cutoff,))
+
+    def _last_seq(self) -> int:
+        """ Sequence number of the last logged change
+        """
+        return self._conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, dict]]:
+        """ Iterate over (id, serialized object) pairs of a class
+        """
+        self._db()
+        with self._lock:
+            # one read transaction: rows and log position must match
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, data FROM objects WHERE class = ?",
+                    (s_class,)).fetchall()
+                self._seen[s_class] = self._last_seq()
+            finally:
+                self._conn.rollback()
+        return ((obj_id, loads(data)) for obj_id, data in rows)
+
+    def changes_since(self, s_class: str
+                      ) -> Optional[List[Tuple[str, Optional[dict]]]]:
+        """ Changes of a class written by other processes since the last
+        load or call: (id, serialized object, or None if removed) pairs,
+        or None when the whole class must be reloaded
+        """
+        self._db()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                seen = self._seen.get(s_class, 0)
+                pruned = self._conn.execute(
+                    "SELECT value FROM meta WHERE name = 'pruned'"
+                    ).fetchone()
+                rows = self._conn.execute(
+                    "SELECT c.id, o.data FROM (SELECT id, MAX(seq) AS seq "
+                    "FROM changes WHERE class = ? AND seq > ? "
+                    "AND origin != ? GROUP BY id) c "
+                    "LEFT JOIN objects o ON o.class = ? AND o.id = c.id "
+                    "ORDER BY c.seq",
+                    (s_class, seen, self._pid, s_class)).fetchall()
+                last = self._last_seq()
+            finally:
+                self._conn.rollback()
+            if pruned is not None and pruned[0] > seen:
+                return None
+            self._seen[s_class] = last
+        if any(obj_id is None for obj_id, _ in rows):
+            return None
+        return [(obj_id, None if data is None else loads(data))
+                for obj_id, data in rows]
+
+    def save_all(self, s_class: str, table: Dict[str, TypeVar('Base')]):
+        """ Persist every object of a class, replacing what is stored,
+        except the objects other processes wrote since this one last
+        synced: those are newer than the table
+        """
+        self._db()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            newer = set(row[0] for row in self._conn.execute(
+                "SELECT id FROM changes WHERE class = ? AND seq > ? "
+                "AND origin != ?",
+                (s_class, self._seen.get(s_class, 0), self._pid)))
+            if None in newer:
+                newer = set(row[0] for row in self._conn.execute(
+                    "SELECT id FROM objects WHERE class = ?", (s_class,)))
+            self._conn.executemany(
+                "DELETE FROM objects WHERE class = ? AND id = ?",
+                [(s_class, row[0]) for row in self._conn.execute(
+                    "SELECT id FROM objects WHERE class = ?", (s_class,))
+                 if row[0] not in newer and row[0] not in table])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO objects (class, id, data) "
+                "VALUES (?, ?, ?)",
+                ((s_class, obj_id, dumps(obj_json))
+                 for obj_id, obj_json in serialized_items(table)
+                 if obj_id not in newer))
+            self._log(s_class, [None])
+
+    def upsert(self, s_class: str, obj: TypeVar('Base'),
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist one created or updated object
+        """
+        data = dumps(obj.to_json(True))
+        self._db()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO objects (class, id, data) "
+                "VALUES (?, ?, ?)", (s_class, obj.id, data))
+            self._log(s_class, [obj.id])
+
+    def delete(self, s_class: str, obj_id: str,
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist the removal of one object
+        """
+        self._db()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM objects WHERE class = ? AND id = ?",
+                (s_class, obj_id))
+            self._log(s_class, [obj_id])
+
+    def apply(self, s_class: str, changes: Dict[str, TypeVar('Base')],
+              table: Dict[str, TypeVar('Base')]):
+        """ Persist a batch of changes in one transaction
+        """
+        upserts = [(s_class, obj_id, dumps(obj.to_json(True)))
+                   for obj_id, obj in changes.items() if obj is not None]
+        deletes = [(s_class, obj_id)
+                   for obj_id, obj in changes.items() if obj is None]
+        self._db()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO objects (class, id, data) "
+                "VALUES (?, ?, ?)", upserts)
+            self._conn.executemany(
+                "DELETE FROM objects WHERE class = ? AND id = ?", deletes)
+            self._log(s_class, changes)
+
+
+class JournalStorage(JSONFileStorage):
+    """ JSON snapshot plus an append-only `.db_<Class>.log` journal
+
+    Each write appends one JSON line to the journal. Loading replays the
+    journal over the snapshot, and once `compact_every` records have been
+    appended the snapshot is rewritten atomically and the journal reset.
+
+    `fsync` is "always" (fsync every write), "never" (leave it to the
+    OS) or a number of milliseconds between two fsyncs: a write that is
+    not synced right away is synced by a timer at the end of the
+    interval, and by close() at exit.
+    """
+
+    full_rewrite = False
+
+    def __init__(self, fsync: str = "always", compact_every: int = 1000):
+        """ Set the fsync policy and the compaction threshold
+        """
+        if fsync not in ("always", "never"):
+            fsync = float(fsync)
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._logs = {}
+        self._pending = {}
+        self._last_sync = {}
+        self._unsynced = set()
+        self._timer = None
+        atexit.register(self.close)
+
+    def log_path(self, s_class: str) -> str:
+        """ Path of the journal of a class
+        """
+        return ".db_{}.log".format(s_class)
+
+    def _replay(self, s_class: str, objs_json: Optional[dict] = None
+                ) -> int:
+        """ Apply the journal to `objs_json` (if given), cut off a torn
+        last record left by a crash in the middle of a write and return
+        the number of records
+        """
+        log_path = self.log_path(s_class)
+        if not path.exists(log_path):
+            return 0
+        good = 0
+        count = 0
+        with open(log_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("torn record")
+                    entry = loads(line)
+                except ValueError:
+                    break
+                if objs_json is None:
+                    pass
+                elif entry["op"] == "save":
+                    objs_json[entry["id"]] = entry["data"]
+                else:
+                    objs_json.pop(entry["id"], None)
+                good += len(line)
+                count += 1
+        if good < path.getsize(log_path):
+            with open(log_path, 'r+b') as f:
+                f.truncate(good)
+        return count
+
+    def load(self, s_class: str) -> Iterator[Tuple[str, dict]]:
+        """ Iterate over (id, serialized object) pairs of a class
+        """
+        objs_json = dict(super().load(s_class))
+        with self._lock:
+            self._close_log(s_class)
+            self._pending[s_class] = self._replay(s_class, objs_json)
+        return iter(objs_json.items())
+
+    def _close_log(self, s_class: str):
+        """ Close the open journal of a class, if any
+        """
+        log = self._logs.pop(s_class, None)
+        if log is not None:
+            if s_class in self._unsynced:
+                os.fsync(log.fileno())
+                self._unsynced.discard(s_class)
+            log.close()
+
+    def close(self):
+        """ Sync and close every open journal
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for s_class in list(self._logs):
+                self._close_log(s_class)
+
+    def _sync_unsynced(self):
+        """ Timer: sync the journals written since their last sync
+        """
+        with self._lock:
+            self._timer = None
+            now = time.monotonic()
+            for s_class in self._unsynced:
+                log = self._logs.get(s_class)
+                if log is not None:
+                    os.fsync(log.fileno())
+                    self._last_sync[s_class] = now
+            self._unsynced.clear()
+
+    def _append(self, s_class: str, entries: Iterable[dict]):
+        """ Append records to the journal and sync them per policy
+        """
+        log = self._logs.get(s_class)
+        if log is None:
+            # Unless load() or a compaction already checked the journal,
+            # cut off a torn tail so that new records do not extend it
+            if s_class not in self._pending:
+                self._pending[s_class] = self._replay(s_class)
+            log = open(self.log_path(s_class), 'a')
+            self._logs[s_class] = log
+        count = 0
+        for entry in entries:
+            log.write(dumps(entry) + "\n")
+            count += 1
+        log.flush()
+        now = time.monotonic()
+        elapsed = (now - self._last_sync.get(s_class, 0)) * 1000
+        if self.fsync == "always" or (
+                self.fsync != "never" and elapsed >= self.fsync):
+            os.fsync(log.fileno())
+            self._last_sync[s_class] = now
+            self._unsynced.discard(s_class)
+        elif self.fsync != "never":
+            self._unsynced.add(s_class)
+            if self._timer is None:
+                self._timer = threading.Timer(
+                    (self.fsync - elapsed) / 1000, self._sync_unsynced)
+                self._timer.daemon = True
+                self._timer.start()
+        self._pending[s_class] = self._pending.get(s_class, 0) + count
+
+    def _write_snapshot(self, s_class: str,
+                        table: Dict[str, TypeVar('Base')]):
+        """ Write the snapshot to a temp file and rename it in place
+        """
+        write_json_object(self.file_path(s_class), serialized_items(table),
+                          fsync=True)
+
+    def compact(self, s_class: str, table: Dict[str, TypeVar('Base')]):
+        """ Fold the journal into a new snapshot
+        """
+        with self._lock:
+            self._compact(s_class, table)
+
+    def _compact(self, s_class: str, table: Dict[str, TypeVar('Base')]):
+        """ Fold the journal into a new snapshot (lock held)
+        """
+        self._write_snapshot(s_class, table)
+        # Replaying a journal over a snapshot that already contains it is
+        # harmless, so a crash before this truncation loses nothing.
+        self._close_log(s_class)
+        open(self.log_path(s_class), 'w').close()
+        self._pending[s_class] = 0
+
+    def save_all(self, s_class: str, table: Dict[str, TypeVar('Base')]):
+        """ Persist every object of a class, replacing what is stored
+        """
+        self.compact(s_class, table)
+
+    def upsert(self, s_class: str, obj: TypeVar('Base'),
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist one created or updated object
+        """
+        entry = {"op": "save", "id": obj.id, "data": obj.to_json(True)}
+        with self._lock:
+            self._append(s_class, [entry])
+            if self._pending[s_class] >= self.compact_every:
+                self._compact(s_class, table)
+
+    def delete(self, s_class: str, obj_id: str,
+               table: Dict[str, TypeVar('Base')]):
+        """ Persist the removal of one object
+        """
+        with self._lock:
+            self._append(s_class, [{"op": "remove", "id": obj_id}])
+            if self._pending[s_class] >= self.compact_every:
+                self._compact(s_class, table)
+
+    def apply(self, s_class: str, changes: Dict[str, TypeVar('Base')],
+              table: Dict[str, TypeVar('Base')]):
+        """ Persist a batch of changes with a single journal sync
+        """
+        entries = [{"op": "remove", "id": obj_id} if obj is None else
+                   {"op": "save", "id": obj_id, "data": obj.to_json(True)}
+                   for obj_id, obj in changes.items()]
+        with self._lock:
+            self._append(s_class, entries)
+            if self._pending[s_class] >= self.compact_every:
+                self._compact(s_class, table)
+
+
+STORAGE = None
+
+
+def get_storage() -> Storage:
+    """ Return the storage engine, chosen on first use by the
+    MODELS_STORAGE environment variable (`json`, `sqlite` or `journal`)
+    """
+    global STORAGE
+    if STORAGE is None:
+        engine = getenv("MODELS_STORAGE", "json")
+        if engine == "sqlite":
+            STORAGE = SQLiteStorage(getenv("MODELS_SQLITE_PATH",
+                                           ".db.sqlite3"))
+        elif engine == "journal":
+            STORAGE = JournalStorage(
+                getenv("MODELS_JOURNAL_FSYNC", "always"),
+                int(getenv("MODELS_JOURNAL_COMPACT", "1000")))
+        elif engine == "json":
+            STORAGE = JSONFileStorage()
+        else:
+            raise ValueError("Unknown MODELS_STORAGE: {}".format(engine))
+    return STORAGE
+
+
+def set_storage(storage: Storage):
+    """ Replace the storage engine used by all models
+    """
+    global STORAGE
+    STORAGE = storage
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress test of the Base object store
+"""
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+from models import base, storage
+from models.user import User
+
+
+WRITERS = 8
+READERS = 4
+WRITES = 150
+
+
+def engine(name):
+    """ Storage engine by MODELS_STORAGE name
+    """
+    if name == "json":
+        return storage.JSONFileStorage()
+    if name == "sqlite":
+        return storage.SQLiteStorage(".db.sqlite3")
+    return storage.JournalStorage("never", compact_every=100)
+
+
+@pytest.fixture
+def contention():
+    """ Switch threads as often as possible while the test runs
+    """
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+
+@pytest.mark.parametrize("name,group_commit", [
+    ("json", False), ("sqlite", False), ("journal", False),
+    ("journal", True)])
+def test_concurrent_writes_and_reads(models_dir, contention, name,
+                                     group_commit):
+    """ Writers save and remove users while readers search and iterate:
+    nothing raises, and memory, indexes and the stored class file agree
+    """
+    storage.set_storage(engine(name))
+    User.load_from_file(lazy=False)
+    if group_commit:
+        base.enable_group_commit(interval_ms=1, max_batch=50)
+    done = threading.Event()
+    errors = []
+    kept = [[] for _ in range(WRITERS)]
+
+    def writer(n):
+        rnd = random.Random(n)
+        try:
+            for i in range(WRITES):
+                if kept[n] and rnd.random() < 0.3:
+                    kept[n].pop(rnd.randrange(len(kept[n]))).remove()
+                else:
+                    user = User(email="{}-{}@example.com".format(n, i))
+                    user.save()
+                    kept[n].append(user)
+        except Exception as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            while not done.is_set():
+                for user in User.all():
+                    assert user.id
+                User.search({"email": "0-0@example.com"})
+                User.first(order_by="email")
+                User.count()
+                time.sleep(0)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    writers = [threading.Thread(target=writer, args=(n,))
+               for n in range(WRITERS)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+    if group_commit:
+        base.disable_group_commit()
+
+    assert errors == []
+    expected = {user.id: user.email for users in kept for user in users}
+    assert {user.id: user.email for user in User.all()} == expected
+    for user_id, email in expected.items():
+        assert [user.id for user in User.search({"email": email})] == \
+            [user_id]
+
+    storage.set_storage(engine(name))
+    User.load_from_file(lazy=False)
+    assert {user.id: user.email for user in User.all()} == expected
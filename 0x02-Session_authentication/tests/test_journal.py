@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+""" Crash recovery of the journal storage engine
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from models import storage
+from models.storage import JournalStorage, set_storage
+from models.user import User
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WRITER = """
+import os
+from models.storage import JournalStorage, set_storage
+from models.user import User
+set_storage(JournalStorage("always", compact_every=1000))
+users = [User(email="user{}@example.com".format(i)) for i in range(50)]
+for user in users:
+    user.save()
+for user in users[:10]:
+    user.remove()
+with open("saved_ids", "w") as f:
+    f.write("\\n".join(user.id for user in users[10:]))
+os._exit(1)
+"""
+
+
+def load_users():
+    """ Load User from the class files with a fresh journal engine
+    """
+    set_storage(JournalStorage("always"))
+    User.load_from_file(lazy=False)
+    return {user.id: user for user in User.all()}
+
+
+def torn_journal(records, tail):
+    """ Write a journal of whole records followed by a torn one
+    """
+    with open(".db_User.log", "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.write(tail)
+
+
+def record(user_id, email):
+    """ Journal record saving a user
+    """
+    return {"op": "save", "id": user_id,
+            "data": {"id": user_id, "email": email}}
+
+
+def test_acknowledged_writes_survive_a_crash(models_dir):
+    """ Every save/remove returned before the process died is replayed
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    result = subprocess.run([sys.executable, "-c", WRITER], env=env)
+    assert result.returncode == 1
+    saved = (models_dir / "saved_ids").read_text().split("\n")
+
+    users = load_users()
+    assert sorted(users) == sorted(saved)
+    assert {user.email for user in users.values()} == \
+        {"user{}@example.com".format(i) for i in range(10, 50)}
+
+
+def test_torn_tail_is_cut_on_load(models_dir):
+    """ A record torn by a crash is dropped and cut off the journal
+    """
+    torn_journal([record("a", "a@example.com")], '{"op": "save", "id": "b"')
+
+    users = load_users()
+    assert list(users) == ["a"]
+    assert (models_dir / ".db_User.log").read_text() == \
+        json.dumps(record("a", "a@example.com")) + "\n"
+
+
+def test_write_before_load_does_not_extend_a_torn_tail(models_dir):
+    """ A save made before load_from_file is not glued onto a torn
+    record, so the next replay keeps it
+    """
+    torn_journal([record("a", "a@example.com")], '{"op": "sa')
+    set_storage(JournalStorage("always"))
+    user = User(email="new@example.com")
+    user.save()
+
+    users = load_users()
+    assert sorted(users) == sorted(["a", user.id])
+
+
+def test_crash_during_compaction(models_dir, monkeypatch):
+    """ Dying after the snapshot is written but before the journal is
+    reset replays the journal over a snapshot that already holds it
+    """
+    set_storage(JournalStorage("always", compact_every=1000))
+    User.load_from_file(lazy=False)
+    users = [User(email="user{}@example.com".format(i)) for i in range(20)]
+    for user in users:
+        user.save()
+    users[0].remove()
+
+    def crash(self, s_class):
+        raise KeyboardInterrupt()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(JournalStorage, "_close_log", crash)
+        with pytest.raises(KeyboardInterrupt):
+            storage.get_storage().compact("User", dict(
+                (user.id, user) for user in users[1:]))
+
+    loaded = load_users()
+    assert sorted(loaded) == sorted(user.id for user in users[1:])
+
+
+def test_interval_policy_syncs_without_a_later_write(models_dir,
+                                                     monkeypatch):
+    """ With an fsync interval a lone write is still synced once the
+    interval has passed, and close() syncs what is pending
+    """
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(storage.os, "fsync",
+                        lambda fd: (synced.append(fd), fsync(fd)))
+    journal = JournalStorage(50)
+    journal._append("User", [{"op": "remove", "id": "a"}])
+    journal._append("User", [{"op": "remove", "id": "b"}])
+    assert len(synced) == 1
+    deadline = time.monotonic() + 5
+    while len(synced) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(synced) == 2
+
+    journal._append("User", [{"op": "remove", "id": "c"}])
+    journal.close()
+    assert len(synced) == 3
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Property-based equivalence of PathMatcher and the original
+Auth.require_auth loop
+"""
+import pytest
+
+from api.v1.auth.auth import Auth, PathMatcher
+
+hypothesis = pytest.importorskip("hypothesis")
+given, settings, st = (hypothesis.given, hypothesis.settings,
+                       hypothesis.strategies)
+
+
+def require_auth_loop(path, excluded_paths):
+    """ Auth.require_auth as it was before PathMatcher
+    """
+    if path is not None and excluded_paths is not None:
+        for exclusion_path in map(str.strip, excluded_paths):
+            pattern = ''
+            if exclusion_path.endswith('*'):
+                pattern = exclusion_path[:-1]
+                if path.startswith(pattern):
+                    return False
+            elif exclusion_path.endswith('/'):
+                pattern = exclusion_path[:-1]
+                if path == pattern or path.startswith(pattern + '/'):
+                    return False
+            else:
+                pattern = exclusion_path
+                if path == pattern or path.startswith(pattern + '/'):
+                    return False
+    return True
+
+
+# Few characters so that paths and rules often share prefixes
+chars = st.text(alphabet="/ab* \t", max_size=10)
+segments = st.lists(st.sampled_from(["api", "v1", "status", "users", "",
+                                     "stat", "*"]), max_size=5)
+api_paths = segments.map("/".join)
+paths = st.one_of(chars, api_paths, api_paths.map(lambda p: p + "/"))
+rules = st.lists(st.one_of(chars, paths, api_paths.map(lambda p: p + "*")),
+                 max_size=6)
+
+
+@settings(max_examples=2000, database=None)
+@given(path=paths, excluded_paths=rules)
+def test_matcher_matches_the_loop(path, excluded_paths):
+    """ A PathMatcher, and a list compiled by require_auth, decide like
+    the loop, including when the memoized decision is reused
+    """
+    expected = require_auth_loop(path, excluded_paths)
+    matcher = PathMatcher(excluded_paths)
+    assert Auth().require_auth(path, matcher) is expected
+    assert Auth().require_auth(path, matcher) is expected
+    assert Auth().require_auth(path, excluded_paths) is expected
+
+
+@settings(database=None)
+@given(path=st.one_of(st.none(), paths))
+def test_none_arguments(path):
+    """ A None path or rule list requires authentication
+    """
+    assert Auth().require_auth(path, None) is True
+    assert Auth().require_auth(None, path and [path]) is True